@@ -0,0 +1,130 @@
+from typing import List
+import numpy as np
+
+from learning_agent import LearningAgent
+from game_state import Action, BatchState, kMaxPlayers
+from poker_deck import PokerDeck, kDefaultVariant
+from metrics import MatchMetrics
+
+
+# Play many hands in lockstep with NumPy arrays, one row per hand.
+# The rules are the same as `TexasHoldemSimulator.playOneHand()`, so a stacked deck gives the same chip results
+# for agents with a deterministic policy. Agents act through the batched `LearningAgent.getActions()`.
+# NOTE: Only the pre-flop game with unlimited stacks, i.e. the simulator defaults `streets = 1` and `stack = 0`.
+# NOTE: No feedback is given to the agents, use the scalar simulator to train learning agents.
+class BatchTexasHoldemSimulator:
+    def __init__(self, agent_list: List[LearningAgent], seed=None, deck_variant=kDefaultVariant):
+        if len(agent_list) > kMaxPlayers:
+            raise ValueError(f'At most {kMaxPlayers} players, the action history encodes the player ids in 4 bits')
+        self.agents = agent_list
+        self.chips = np.zeros(len(self.agents))
+        self.dealer_id = 0   # Dealer of the first hand in the next batch, it shifts by one for each hand.
+        self.rng = np.random.default_rng(seed)
+        self.deck = PokerDeck(deck_variant)  # Only used for the deck size and ranks.
+        self.deck_size = self.deck.size
+
+
+    # Shuffled decks with shape (hands, deck_size). Row i is dealt from the first column.
+    def dealDecks(self, hands: int) -> np.ndarray:
+        return self.rng.permuted(np.tile(np.arange(self.deck_size), (hands, 1)), axis=1)
+
+
+    # Same as `TexasHoldemSimulator.winningHand()` for the pre-flop only game. `hands` has shape (N, players, 2).
+    def handRanks(self, hands: np.ndarray) -> np.ndarray:
+        num_ranks = len(self.deck.kRanks)
+        num_1 = hands[:, :, 0] % num_ranks + 1
+        num_2 = hands[:, :, 1] % num_ranks + 1
+        high = np.maximum(num_1, num_2)
+        low = np.minimum(num_1, num_2)
+        return np.where(num_1 == num_2, num_1 * num_ranks ** 2, high * num_ranks + low)
+
+
+    # Play one hand for each deck. Return the chip change of each player with shape (N, players).
+    def playHands(self, decks: np.ndarray) -> np.ndarray:
+        total_hands = len(decks)
+        total_players = len(self.agents)
+        rows = np.arange(total_hands)
+        dealer = (self.dealer_id + rows) % total_players
+
+        # NOTE: One simplfy is limited to only AA, KK, QQ
+        cards = decks[:, :total_players]
+        hands = np.stack((cards, cards), axis=2)
+
+        # Blinds
+        small_blind = (dealer + 1) % total_players
+        big_blind = (dealer + 2) % total_players
+        players_bet = np.zeros((total_hands, total_players), dtype=np.int64)
+        players_bet[rows, small_blind] += 1
+        players_bet[rows, big_blind] += 2
+        pot = np.full(total_hands, 3, dtype=np.int64)
+        current_bet = np.full(total_hands, 2, dtype=np.int64)
+        actions = np.zeros((total_hands, 16), dtype=np.int16)
+        actions[:, 0] = (small_blind << 2) | Action.RAISE.value
+        actions[:, 1] = (big_blind << 2) | Action.RAISE.value
+        num_actions = np.full(total_hands, 2, dtype=np.int64)
+
+        # Pre-flop
+        folded = np.zeros((total_hands, total_players), dtype=bool)
+        actor = (dealer + 3) % total_players
+        to_act = np.full(total_hands, total_players, dtype=np.int64)  # Players who still have to talk, see `TexasHoldemSimulator.runStreet()`.
+        live = np.ones(total_hands, dtype=bool)
+        offsets = np.arange(1, total_players)
+        while live.any():
+            idx = np.flatnonzero(live)
+            if num_actions.max() == actions.shape[1]:
+                actions = np.concatenate((actions, np.zeros_like(actions)), axis=1)
+            states = BatchState(idx, actor, hands, pot, current_bet, players_bet, actions, num_actions, self.rng)
+            call_cost = states.getCallCost()
+            raise_cost = states.getRaiseCost()
+            acting = actor[idx]
+
+            action = np.empty(len(idx), dtype=np.int64)
+            for id in range(total_players):
+                selected = acting == id
+                if selected.any():
+                    action[selected] = self.agents[id].getActions(BatchState(idx[selected], actor, hands, pot, current_bet, players_bet, actions, num_actions, self.rng))
+
+            is_raise = action == Action.RAISE.value
+            amount = np.where(is_raise, call_cost + raise_cost, np.where(action == Action.CALL.value, call_cost, 0))
+            pot[idx] += amount
+            players_bet[idx, acting] += amount
+            current_bet[idx] += np.where(is_raise, raise_cost, 0)
+            is_fold = action == Action.FOLD.value
+            folded[idx[is_fold], acting[is_fold]] = True
+            # A raise lets everyone else still in the hand talk again.
+            to_act[idx] = np.where(is_raise, (~folded[idx]).sum(axis=1) - 1, to_act[idx] - 1)
+            actions[idx, num_actions[idx]] = (acting << 2) | action
+            num_actions[idx] += 1
+
+            # Everyone talked since the last raise, or only one player left.
+            done = (to_act[idx] == 0) | ((~folded[idx]).sum(axis=1) <= 1)
+            live[idx[done]] = False
+
+            # The next player is the first one not folded after the current player.
+            idx, acting = idx[~done], acting[~done]
+            seats = (acting[:, None] + offsets) % total_players
+            first = (~folded[idx[:, None], seats]).argmax(axis=1)
+            actor[idx] = seats[np.arange(len(idx)), first]
+
+        # Showdown, the winners split the pot.
+        ranks = np.where(folded, -1, self.handRanks(hands))
+        winners = ranks == ranks.max(axis=1, keepdims=True)
+        rewards = np.where(winners, (pot / winners.sum(axis=1))[:, None], 0.0)
+        results = rewards - players_bet
+
+        self.chips += results.sum(axis=0)
+        self.dealer_id = (self.dealer_id + total_hands) % total_players
+        return results
+
+
+    # Same early stop as `TexasHoldemSimulator.run()`, checked after each batch.
+    def run(self, hands: int, batch_size=4096, ci_half_width=0.0, min_hands=1000, confidence=0.95) -> MatchMetrics:
+        metrics = MatchMetrics(len(self.agents), confidence)
+        for start in range(0, hands, batch_size):
+            metrics.updateBatch(self.playHands(self.dealDecks(min(batch_size, hands - start))))
+            print(f'{metrics.hands}/{hands} hands.')
+            if ci_half_width > 0 and metrics.converged(ci_half_width, min_hands):
+                break
+
+        print(metrics.report())
+        return metrics
\ No newline at end of file
@@ -0,0 +1,269 @@
+from itertools import combinations_with_replacement
+from typing import Callable, Dict, List
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from learning_agent import LearningAgent, QLearningAgent, HashedQLearningAgent, StochasticAgent, AKQAgent
+from game_state import State, PublicState, ExclusiveState, Action, kEmptyHistory, getActions
+from weight_store import WeightStore
+from poker_deck import PokerDeck, kVariants
+from simulator import TexasHoldemSimulator, identityFeatureExtractor, stateFeatureExtractor, encodeIdentityFeature
+from policy_table import FrozenPolicyAgent, compilePolicy
+import hand_evaluator
+
+
+# Benchmark suite for the hot paths. Run it as a module:
+#
+#   python -m benchmark --output bench.json
+#   python -m benchmark --output new.json --compare bench.json
+#
+# Every case uses a fixed seed. The results are rates where bigger is better, except the memory cases which are
+# in bytes where smaller is better.
+
+kSeed = 1234
+kAgentFactories: Dict[str, Callable[[], LearningAgent]] = {
+    'AKQAgent': AKQAgent,
+    'QLearningAgent': lambda: QLearningAgent(getActions, 1.0, identityFeatureExtractor),
+    'StochasticAgent': StochasticAgent,
+}
+
+
+def rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds > 0 else float('inf')
+
+
+def benchPlayOneHand(agent_names: List[str], hands: int) -> float:
+    random.seed(kSeed)
+    simulator = TexasHoldemSimulator([kAgentFactories[name]() for name in agent_names], verbose=0)
+    start = time.perf_counter()
+    for _ in range(hands):
+        simulator.playOneHand()
+    return rate(hands, time.perf_counter() - start)
+
+
+# Full hold'em: every street with the full deck and finite stacks, so all-ins and side pots happen too.
+def benchFullHand(players: int, hands: int) -> float:
+    random.seed(kSeed)
+    simulator = TexasHoldemSimulator([StochasticAgent() for _ in range(players)], verbose=0, deck_variant='full', streets=4, stack=200)
+    start = time.perf_counter()
+    for _ in range(hands):
+        simulator.playOneHand()
+    return rate(hands, time.perf_counter() - start)
+
+
+def benchShowdown(hands: int) -> float:
+    random.seed(kSeed)
+    simulator = TexasHoldemSimulator([AKQAgent(), AKQAgent()], verbose=0)
+    deck = PokerDeck()
+    cards = list(range(deck.size))
+    deals = [[(card, card) for card in random.sample(cards, 2)] for _ in range(1000)]
+    start = time.perf_counter()
+    for i in range(hands):
+        simulator.winningHand(deals[i % len(deals)], (), deck)
+    return rate(hands, time.perf_counter() - start)
+
+
+# Showdown of two card hands of the full deck with a 5 card board, each player's hand is evaluated on 7 cards.
+def benchShowdownBoard(hands: int, players=2) -> float:
+    random.seed(kSeed)
+    simulator = TexasHoldemSimulator([AKQAgent() for _ in range(players)], verbose=0, deck_variant='full', streets=4)
+    deck = PokerDeck('full')
+    deals = []
+    for _ in range(1000):
+        cards = random.sample(range(deck.size), 2 * players + 5)
+        deals.append(([(cards[2 * i], cards[2 * i + 1]) for i in range(players)], tuple(cards[2 * players:])))
+    start = time.perf_counter()
+    for i in range(hands):
+        hole_cards, board = deals[i % len(deals)]
+        simulator.winningHand(hole_cards, board, deck)
+    return rate(hands, time.perf_counter() - start)
+
+
+# Reset the reused deck and deal one card to each of `players`, as `playOneHand()` does for every hand.
+def benchDeal(variant: str, hands: int, players=2) -> float:
+    random.seed(kSeed)
+    deck = PokerDeck(variant)
+    start = time.perf_counter()
+    for _ in range(hands):
+        deck.reset()
+        for _ in range(players):
+            deck.dealCard()
+    return rate(hands, time.perf_counter() - start)
+
+
+def benchEvaluateMask(hands: int) -> float:
+    random.seed(kSeed)
+    hand_evaluator.loadTables()
+    deck = PokerDeck('full')
+    masks = [deck.cardsMask(random.sample(range(52), 7)) for _ in range(1000)]
+    start = time.perf_counter()
+    for i in range(hands):
+        hand_evaluator.evaluateMask(masks[i % len(masks)])
+    return rate(hands, time.perf_counter() - start)
+
+
+def benchEvaluate(hands: int) -> float:
+    random.seed(kSeed)
+    hand_evaluator.loadTables()
+    deals = [random.sample(range(52), 7) for _ in range(1000)]
+    start = time.perf_counter()
+    for i in range(hands):
+        hand_evaluator.evaluate(deals[i % len(deals)])
+    return rate(hands, time.perf_counter() - start)
+
+
+def benchEvaluateBatch(hands: int) -> float:
+    rng = np.random.default_rng(kSeed)
+    hand_evaluator.loadTables()
+    deals = rng.permuted(np.tile(np.arange(52), (hands, 1)), axis=1)[:, :7]
+    start = time.perf_counter()
+    hand_evaluator.evaluateBatch(deals)
+    return rate(hands, time.perf_counter() - start)
+
+
+# States with random pre-flop histories, shared by the learner cases.
+def makeStates(count: int, players=2) -> List[State]:
+    random.seed(kSeed)
+    states = []
+    for _ in range(count):
+        public = PublicState(players)
+        history = kEmptyHistory
+        for _ in range(random.randint(2, 8)):
+            history = history.append(random.randrange(players), random.choice(list(Action)))
+        public.preflop_actions = history
+        card = random.randrange(3)
+        states.append(State(ExclusiveState(random.randrange(players), (card, card)), public))
+    return states
+
+
+def benchGetQ(updates: int) -> float:
+    agent = kAgentFactories['QLearningAgent']()
+    states = makeStates(1000)
+    for state in states:
+        agent.incorporateFeedback(state, Action.CALL, 1.0, None)
+    start = time.perf_counter()
+    for i in range(updates):
+        agent.getQ(states[i % len(states)], Action.CALL)
+    return rate(updates, time.perf_counter() - start)
+
+
+# Q values of all the actions of a state seen for the first time, i.e. including the feature hashing.
+def benchHashedQValues(calls: int) -> float:
+    agent = HashedQLearningAgent(getActions, 1.0, stateFeatureExtractor)
+    states = makeStates(1000)
+    actions = list(Action)
+    start = time.perf_counter()
+    for i in range(calls):
+        agent.getQValues(states[i % len(states)], actions)
+    return rate(calls, time.perf_counter() - start)
+
+
+# getAction() of a `FrozenPolicyAgent` compiled from a trained `QLearningAgent`.
+def benchFrozenPolicy(calls: int) -> float:
+    random.seed(kSeed)
+    agent = kAgentFactories['QLearningAgent']()
+    simulator = TexasHoldemSimulator([agent, AKQAgent()], verbose=0)
+    for _ in range(2000):
+        simulator.playOneHand()
+    frozen = FrozenPolicyAgent(compilePolicy(agent))
+    states = makeStates(1000)
+    start = time.perf_counter()
+    for i in range(calls):
+        frozen.getAction(states[i % len(states)])
+    return rate(calls, time.perf_counter() - start)
+
+
+def benchIncorporateFeedback(updates: int) -> float:
+    random.seed(kSeed)
+    agent = kAgentFactories['QLearningAgent']()
+    states = makeStates(1000)
+    actions = list(Action)
+    start = time.perf_counter()
+    for i in range(updates):
+        agent.incorporateFeedback(states[i % len(states)], actions[i % 3], random.random(), states[(i + 1) % len(states)])
+    return rate(updates, time.perf_counter() - start)
+
+
+# Peak bytes of a `WeightStore` holding one million identity features, measured on `features` and scaled.
+# The `i << 80` term makes every key distinct and as wide as the key of a long action history.
+def benchMemoryPerMillionFeatures(features: int) -> float:
+    history = kEmptyHistory.append(0, Action.RAISE).append(1, Action.RAISE)
+    tracemalloc.start()
+    weights = WeightStore()
+    for i in range(features):
+        weights[encodeIdentityFeature(i % 2, (i % 3, i % 3), history.append(i % 2, Action.CALL).code, Action.CALL) + (i << 80)] = 1.0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / features * 1e6
+
+
+def runBenchmarks(quick=False) -> Dict[str, float]:
+    scale = 10 if quick else 1
+    results = {}
+    for mix in combinations_with_replacement(kAgentFactories, 2):
+        results[f'playOneHand[{"+".join(mix)}] hands/sec'] = benchPlayOneHand(list(mix), 20000 // scale)
+    for players in (2, 6):
+        results[f"playOneHand[full hold'em, {players} players] hands/sec"] = benchFullHand(players, 20000 // scale)
+    results['winningHand pre-flop evals/sec'] = benchShowdown(200000 // scale)
+    for players in (2, 6):
+        results[f'winningHand[5 card board, {players} players] evals/sec'] = benchShowdownBoard(100000 // scale, players)
+    for variant in kVariants:
+        results[f'PokerDeck reset+deal[{variant}] hands/sec'] = benchDeal(variant, 200000 // scale)
+    results['hand_evaluator.evaluate evals/sec'] = benchEvaluate(200000 // scale)
+    results['hand_evaluator.evaluateMask evals/sec'] = benchEvaluateMask(200000 // scale)
+    results['hand_evaluator.evaluateBatch evals/sec'] = benchEvaluateBatch(1000000 // scale)
+    results['getQ calls/sec'] = benchGetQ(200000 // scale)
+    results['incorporateFeedback updates/sec'] = benchIncorporateFeedback(200000 // scale)
+    results['HashedQLearningAgent getQValues calls/sec'] = benchHashedQValues(200000 // scale)
+    results['FrozenPolicyAgent getAction calls/sec'] = benchFrozenPolicy(200000 // scale)
+    results['peak memory bytes/million features'] = benchMemoryPerMillionFeatures(200000 // scale)
+    return results
+
+
+# Return the cases that got worse than the baseline by more than `tolerance` (a fraction).
+def findRegressions(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or baseline[name] <= 0:
+            continue
+        lower_is_better = 'bytes' in name
+        change = (baseline[name] - value) / baseline[name] if not lower_is_better else (value - baseline[name]) / baseline[name]
+        if change > tolerance:
+            regressions.append(f'{name}: {baseline[name]:.1f} -> {value:.1f} ({change * 100:.1f}% worse)')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the simulator, evaluator and learner hot paths.')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to.')
+    parser.add_argument('--compare', default='', help='Baseline JSON file written by a previous run.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed slow down before a case is a regression.')
+    parser.add_argument('--quick', action='store_true', help='Run 10x fewer iterations.')
+    args = parser.parse_args(argv)
+
+    results = runBenchmarks(args.quick)
+    for name, value in results.items():
+        print(f'{name:<70} {value:>16.1f}')
+
+    with open(args.output, 'w') as file:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                   'machine': platform.machine(), 'seed': kSeed, 'quick': args.quick, 'results': results}, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = findRegressions(results, json.load(file)['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
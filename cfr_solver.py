@@ -0,0 +1,288 @@
+from typing import Dict, List, Optional, Tuple
+import random
+import time
+
+import numpy as np
+
+from learning_agent import LearningAgent
+from game_state import State, PublicState, ExclusiveState, Action, getActions
+from poker_deck import PokerDeck
+
+
+# Counterfactual regret minimization for the heads-up pre-flop game of `TexasHoldemSimulator`, where each player
+# gets one card of a reduced deck (AKQ or Leduc).
+#
+# The betting tree is built once from `getActions()` and the half pot raise of `State.getRaiseCost()`, for both
+# dealer positions, with at most `max_raises` raises after the blinds. The regrets and strategy sums are flat arrays
+# indexed by (infoset, action), where an infoset is (decision node, card of the player to act). Each iteration
+# walks the tree one level at a time, with every node of the level and every deal updated by NumPy operations.
+#
+# Variants:
+# - 'cfr': vanilla CFR.
+# - 'cfr+': regrets are floored at 0 and the average strategy is weighted linearly.
+# - 'dcfr': discounted CFR with alpha = 1.5, beta = 0, gamma = 2.
+
+kActions = list(Action)
+kPlayers = 2
+
+
+class BettingTree:
+    def __init__(self, max_raises=3):
+        self.actor: List[int] = []            # Player to act, -1 for terminal nodes.
+        self.depth: List[int] = []
+        self.children: List[List[int]] = []   # Child for each action in `kActions`, -1 if the action is illegal.
+        self.history: List[int] = []          # `ActionHistory.code` of the node.
+        self.players_bet: List[List[int]] = []
+        self.folded: List[int] = []           # Player who folded at a terminal node, -1 for a showdown.
+        self.max_raises = max_raises
+        for dealer_id in range(kPlayers):
+            self.addRoot(dealer_id)
+
+
+    def addNode(self, actor: int, depth: int, public: PublicState, folded=-1) -> int:
+        self.actor.append(actor)
+        self.depth.append(depth)
+        self.children.append([-1] * len(kActions))
+        self.history.append(public.preflop_actions.code)
+        self.players_bet.append(list(public.players_bet))
+        self.folded.append(folded)
+        return len(self.actor) - 1
+
+
+    # Same as `TexasHoldemSimulator.putBlinds()`.
+    def addRoot(self, dealer_id: int) -> None:
+        public = PublicState(kPlayers)
+        for id, amount in (((dealer_id + 1) % kPlayers, 1), ((dealer_id + 2) % kPlayers, 2)):
+            public.preflop_actions = public.preflop_actions.append(id, Action.RAISE)
+            public.pot += amount
+            public.players_bet[id] += amount
+        public.current_bet = 2
+        first_id = (dealer_id + 3) % kPlayers
+        self.expand(first_id, first_id, 0, 0, public)
+
+
+    # Same as the pre-flop `TexasHoldemSimulator.runStreet()` for two players.
+    def expand(self, id: int, stop_id: int, raises: int, depth: int, public: PublicState) -> int:
+        node = self.addNode(id, depth, public)
+        state = State(ExclusiveState(id, (0, 0)), public)
+        call_cost = state.getCallCost()
+        raise_cost = state.getRaiseCost()
+        for action in getActions(state):
+            if action == Action.RAISE and raises >= self.max_raises:
+                continue
+            child = PublicState(kPlayers)
+            child.preflop_actions = public.preflop_actions.append(id, action)
+            child.pot = public.pot
+            child.current_bet = public.current_bet
+            child.players_bet = list(public.players_bet)
+            amount = {Action.FOLD: 0, Action.CALL: call_cost, Action.RAISE: call_cost + raise_cost}[action]
+            child.pot += amount
+            child.players_bet[id] += amount
+            if action == Action.FOLD:
+                child_node = self.addNode(-1, depth + 1, child, folded=id)
+            elif action == Action.RAISE:
+                child.current_bet += raise_cost
+                child_node = self.expand((id + 1) % kPlayers, id, raises + 1, depth + 1, child)
+            elif (id + 1) % kPlayers == stop_id:
+                child_node = self.addNode(-1, depth + 1, child)  # Showdown.
+            else:
+                child_node = self.expand((id + 1) % kPlayers, stop_id, raises, depth + 1, child)
+            self.children[node][kActions.index(action)] = child_node
+        return node
+
+
+
+class CFRSolver:
+    def __init__(self, deck: Optional[PokerDeck] = None, max_raises=3, variant='cfr+'):
+        assert variant in ('cfr', 'cfr+', 'dcfr')
+        self.variant = variant
+        self.deck = deck or PokerDeck()
+        self.num_cards = self.deck.size
+        self.tree = BettingTree(max_raises)
+        self.iterations = 0
+
+        # Chance: every ordered pair of distinct cards, for both dealer positions (one root each).
+        self.deals = np.array([(c0, c1) for c0 in range(self.num_cards) for c1 in range(self.num_cards) if c0 != c1])
+        num_deals = len(self.deals)
+        self.chance = 1.0 / (num_deals * kPlayers)
+
+        # Tree arrays, with an extra all-zero "null" node that illegal actions point to.
+        num_nodes = len(self.tree.actor)
+        self.actor = np.array(self.tree.actor)
+        self.children = np.array(self.tree.children)
+        self.legal = self.children >= 0
+        self.children[~self.legal] = num_nodes
+        self.roots = np.flatnonzero(np.array(self.tree.depth) == 0)
+        decision_nodes = np.flatnonzero(self.actor >= 0)
+        self.info_base = np.full(num_nodes, -1)
+        self.info_base[decision_nodes] = np.arange(len(decision_nodes)) * self.num_cards
+        self.levels = [decision_nodes[np.array(self.tree.depth)[decision_nodes] == depth] for depth in range(max(self.tree.depth) + 1)]
+        self.levels = [level for level in self.levels if len(level)]
+
+        num_infosets = len(decision_nodes) * self.num_cards
+        self.infoset_legal = np.repeat(self.legal[decision_nodes], self.num_cards, axis=0)
+        self.regrets = np.zeros((num_infosets, len(kActions)))
+        self.strategy_sum = np.zeros((num_infosets, len(kActions)))
+
+        # Terminal utilities with shape (num_nodes + 1, players, deals).
+        self.terminal_utility = np.zeros((num_nodes + 1, kPlayers, num_deals))
+        ranks = self.deals % len(self.deck.kRanks)
+        for node in np.flatnonzero(self.actor < 0):
+            bets = np.array(self.tree.players_bet[node], dtype=float)
+            if self.tree.folded[node] >= 0:
+                winners = np.ones((num_deals, kPlayers), dtype=bool)
+                winners[:, self.tree.folded[node]] = False
+            else:
+                winners = ranks == ranks.max(axis=1, keepdims=True)
+            share = bets.sum() / winners.sum(axis=1, keepdims=True)
+            self.terminal_utility[node] = (np.where(winners, share, 0.0) - bets).T
+
+
+    # Regret matching, uniform over the legal actions when no regret is positive.
+    def currentStrategy(self) -> np.ndarray:
+        positive = np.maximum(self.regrets, 0.0) * self.infoset_legal
+        total = positive.sum(axis=1, keepdims=True)
+        uniform = self.infoset_legal / self.infoset_legal.sum(axis=1, keepdims=True)
+        return np.where(total > 0, positive / np.where(total > 0, total, 1.0), uniform)
+
+
+    def averageStrategy(self) -> np.ndarray:
+        total = self.strategy_sum.sum(axis=1, keepdims=True)
+        uniform = self.infoset_legal / self.infoset_legal.sum(axis=1, keepdims=True)
+        return np.where(total > 0, self.strategy_sum / np.where(total > 0, total, 1.0), uniform)
+
+
+    # Infoset of each (node, deal) of a level, with shape (nodes, deals).
+    def infosets(self, level: np.ndarray) -> np.ndarray:
+        return self.info_base[level][:, None] + self.deals[:, self.actor[level]].T
+
+
+    # Reach probability of each player, with shape (num_nodes + 1, players, deals).
+    def reachProbabilities(self, strategy: np.ndarray) -> np.ndarray:
+        reach = np.zeros((len(self.actor) + 1, kPlayers, len(self.deals)))
+        reach[self.roots] = 1.0
+        for level in self.levels:
+            actors = self.actor[level]
+            probs = strategy[self.infosets(level)]  # (nodes, deals, actions)
+            for a in range(len(kActions)):
+                children = self.children[level, a]
+                reach[children] = reach[level]
+                reach[children, actors] *= probs[:, :, a]
+        return reach
+
+
+    def iterate(self) -> None:
+        self.iterations += 1
+        t = self.iterations
+        strategy = self.currentStrategy()
+        reach = self.reachProbabilities(strategy)
+
+        regret_delta = np.zeros_like(self.regrets)
+        strategy_delta = np.zeros_like(self.strategy_sum)
+        utility = self.terminal_utility.copy()
+        for level in reversed(self.levels):
+            rows = np.arange(len(level))
+            actors = self.actor[level]
+            infosets = self.infosets(level)
+            probs = strategy[infosets]                           # (nodes, deals, actions)
+            child_utility = utility[self.children[level]]        # (nodes, actions, players, deals)
+            node_utility = (probs.transpose(0, 2, 1)[:, :, None, :] * child_utility).sum(axis=1)
+            utility[level] = node_utility
+
+            actor_child = child_utility[rows, :, actors]         # (nodes, actions, deals)
+            actor_node = node_utility[rows, actors]              # (nodes, deals)
+            opponent_reach = reach[level, 1 - actors] * self.chance
+            regrets = (actor_child - actor_node[:, None, :]) * opponent_reach[:, None, :] * self.legal[level][:, :, None]
+            np.add.at(regret_delta, infosets.ravel(), regrets.transpose(0, 2, 1).reshape(-1, len(kActions)))
+            own_reach = reach[level, actors]
+            np.add.at(strategy_delta, infosets.ravel(), (probs * own_reach[:, :, None]).reshape(-1, len(kActions)))
+
+        if self.variant == 'cfr':
+            self.regrets += regret_delta
+            self.strategy_sum += strategy_delta
+        elif self.variant == 'cfr+':
+            self.regrets = np.maximum(self.regrets + regret_delta, 0.0)
+            self.strategy_sum += t * strategy_delta
+        else:  # 'dcfr'
+            alpha, beta, gamma = 1.5, 0.0, 2.0
+            positive = t ** alpha / (t ** alpha + 1)
+            negative = t ** beta / (t ** beta + 1)
+            self.regrets *= np.where(self.regrets > 0, positive, negative)
+            self.regrets += regret_delta
+            self.strategy_sum *= (t / (t + 1)) ** gamma
+            self.strategy_sum += strategy_delta
+
+
+    # Expected chips per hand of `player` when it best responds to the average strategy of the opponent.
+    def bestResponseValue(self, player: int) -> float:
+        strategy = self.averageStrategy()
+        reach = self.reachProbabilities(strategy)
+        utility = self.terminal_utility[:, player].copy()
+        for level in reversed(self.levels):
+            actors = self.actor[level]
+            infosets = self.infosets(level)
+            child_utility = utility[self.children[level]]       # (nodes, actions, deals)
+            node_utility = (strategy[infosets].transpose(0, 2, 1) * child_utility).sum(axis=1)
+
+            mine = actors == player
+            if mine.any():
+                # Pick the best action of each infoset, with the counterfactual values summed over its deals.
+                values = child_utility[mine] * reach[level[mine], 1 - player][:, None, :]
+                totals = np.zeros_like(self.regrets)
+                np.add.at(totals, infosets[mine].ravel(), values.transpose(0, 2, 1).reshape(-1, len(kActions)))
+                best = np.where(self.infoset_legal, totals, -np.inf).argmax(axis=1)[infosets[mine]]  # (nodes, deals)
+                node_utility[mine] = np.take_along_axis(child_utility[mine], best[:, None, :], axis=1)[:, 0, :]
+            utility[level] = node_utility
+        return float(utility[self.roots].sum() * self.chance)
+
+
+    # Chips per hand the average strategy loses against a best response, 0 at a Nash equilibrium.
+    def exploitability(self) -> float:
+        return (self.bestResponseValue(0) + self.bestResponseValue(1)) / 2
+
+
+    def solve(self, iterations: int, report_every=0) -> float:
+        start = time.perf_counter()
+        for i in range(iterations):
+            self.iterate()
+            if report_every and (i + 1) % report_every == 0:
+                print(f'Iteration {self.iterations}: exploitability {self.exploitability():.5f} chips/hand, {time.perf_counter() - start:.2f}s')
+        return self.exploitability()
+
+
+    # Average strategy keyed by (my_id, card, ActionHistory.code).
+    def strategyTable(self) -> Dict[Tuple[int, int, int], List[float]]:
+        strategy = self.averageStrategy()
+        table = {}
+        for node in np.flatnonzero(self.actor >= 0):
+            for card in range(self.num_cards):
+                table[(int(self.actor[node]), card, self.tree.history[node])] = strategy[self.info_base[node] + card].tolist()
+        return table
+
+
+    def makeAgent(self) -> 'CFRAgent':
+        return CFRAgent(self.strategyTable())
+
+
+
+# Play the solved strategy. Outside of the solved tree (e.g. more raises than `max_raises`) it calls.
+class CFRAgent(LearningAgent):
+    def __init__(self, strategy: Dict[Tuple[int, int, int], List[float]]):
+        self.strategy = strategy
+
+    def getAction(self, state: State) -> Action:
+        probs = self.strategy.get((state.exclusive.my_id, state.exclusive.my_hand[0], state.public.preflop_actions.code))
+        if probs is None:
+            return Action.CALL
+        return random.choices(kActions, weights=probs)[0]
+
+
+def main():
+    solver = CFRSolver(PokerDeck(), max_raises=3, variant='cfr+')
+    solver.solve(1000, report_every=100)
+    for (my_id, card, history), probs in sorted(solver.strategyTable().items()):
+        print(my_id, card, history, [f'{prob:.2f}' for prob in probs])
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+from typing import Any, Collection, Iterator, List, Tuple, Union
+import bisect
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+
+from weight_store import WeightStore
+
+
+# Binary weight checkpoint, all numbers are little-endian:
+#
+# | header | key table | padding to 8 bytes | float64 weights |
+#
+# header: magic, version, key format, numIters, number of features, key width, key table size.
+# Key formats:
+# - kIntKeys: the keys are non-negative ints stored with a fixed width, big-endian and sorted ascending, so a key
+#   can be binary searched directly in the file. The weights follow the same order.
+# - kPickledKeys: any other key type, the key list is pickled. The weights follow the order of the list.
+#
+# The weights are a contiguous float64 array, so a checkpoint can be memory-mapped read-only and shared by
+# several processes.
+
+kMagic = b'THQCKPT\0'
+kVersion = 1
+kIntKeys = 0
+kPickledKeys = 1
+kHeader = struct.Struct('<8sIIqqqq')
+kLimbMask = (1 << 64) - 1
+
+
+def isCheckpoint(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(kMagic)) == kMagic
+
+
+# Split each non-negative int key into 64-bit limbs, most significant first, as a (limbs, keys) array.
+def intKeyLimbs(keys: Collection[int], key_width: int) -> np.ndarray:
+    count = (key_width + 7) // 8
+    if count == 1:
+        return np.fromiter(keys, dtype=np.uint64, count=len(keys))[None, :]
+    return np.array([np.fromiter(((key >> (64 * limb)) & kLimbMask for key in keys), dtype=np.uint64, count=len(keys))
+                     for limb in reversed(range(count))])
+
+
+# Write to a temporary file then rename, so a crash never leaves a broken checkpoint behind.
+def saveCheckpoint(path: str, weights: WeightStore, num_iters: int) -> None:
+    if sys.byteorder != 'little':
+        raise ValueError('Checkpoints are only supported on little-endian machines')
+    keys = weights.interner.index  # In index order, the order of the weights.
+    values = np.frombuffer(weights.values, dtype=np.float64)
+    if all(type(key) is int and key >= 0 for key in keys):
+        key_format = kIntKeys
+        key_width = max(1, (max(keys, default=0).bit_length() + 7) // 8)
+        limbs = intKeyLimbs(keys, key_width)
+        order = np.lexsort(limbs[::-1])
+        # Big-endian rows of the sorted keys, cut to `key_width` bytes.
+        key_table = np.stack(limbs, axis=1).take(order, axis=0).astype('>u8').view(np.uint8)[:, -key_width:].tobytes()
+        values = values.take(order)
+    else:
+        key_format = kPickledKeys
+        key_width = 0
+        key_table = pickle.dumps(list(keys), protocol=pickle.HIGHEST_PROTOCOL)
+
+    padding = -(kHeader.size + len(key_table)) % 8
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(kHeader.pack(kMagic, kVersion, key_format, num_iters, len(keys), key_width, len(key_table)))
+        file.write(key_table)
+        file.write(b'\0' * padding)
+        file.write(values.tobytes())
+    os.replace(temp_path, path)
+
+
+# The int keys of a kIntKeys checkpoint, read from the mapped file on demand.
+class _KeyTable:
+    def __init__(self, buffer: mmap.mmap, offset: int, width: int, size: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.width = width
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, idx: int) -> int:
+        start = self.offset + idx * self.width
+        return int.from_bytes(self.buffer[start:start + self.width], 'big')
+
+
+# Read-only weights backed by a memory-mapped checkpoint. It has the read API of `WeightStore`, so a
+# `QLearningAgent` can serve from it without loading the whole table.
+class MappedWeights:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.key_format, self.num_iters, size, key_width, key_table_size = kHeader.unpack_from(self.buffer)
+        if magic != kMagic or version != kVersion:
+            raise ValueError(f'{path} is not a version {kVersion} checkpoint')
+
+        weights_offset = kHeader.size + key_table_size
+        weights_offset += -weights_offset % 8
+        self.view = memoryview(self.buffer)
+        self.values = self.view[weights_offset:weights_offset + size * 8].cast('d')
+        self.key_table = _KeyTable(self.buffer, kHeader.size, key_width, size)
+        self.index = None
+        if self.key_format == kPickledKeys:
+            keys = pickle.loads(self.buffer[kHeader.size:kHeader.size + key_table_size])
+            self.index = {key: idx for idx, key in enumerate(keys)}
+
+
+    # A mapping can't be pickled, the file is mapped again from its path instead (e.g. in a worker process).
+    def __reduce__(self):
+        return MappedWeights, (self.path,)
+
+
+    def close(self) -> None:
+        self.values.release()
+        self.view.release()
+        self.buffer.close()
+
+
+    def indexOf(self, key: Any) -> int:
+        if self.index is not None:
+            return self.index.get(key, -1)
+        if type(key) is not int or key < 0:
+            return -1
+        idx = bisect.bisect_left(self.key_table, key)
+        return idx if idx < len(self.key_table) and self.key_table[idx] == key else -1
+
+
+    def lookup(self, features: List[Tuple[Any, float]]) -> Tuple[List[int], List[float]]:
+        return [self.indexOf(key) for key, _ in features], [value for _, value in features]
+
+
+    def intern(self, features: List[Tuple[Any, float]]) -> Tuple[List[int], List[float]]:
+        raise TypeError('Memory-mapped weights are read-only, load the checkpoint with read_only=False to train')
+
+
+    dot = WeightStore.dot
+
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+    def __contains__(self, key: Any) -> bool:
+        return self.indexOf(key) >= 0
+
+
+    def __getitem__(self, key: Any) -> float:
+        idx = self.indexOf(key)
+        return self.values[idx] if idx >= 0 else 0.0
+
+
+    def keys(self) -> Iterator[Any]:
+        if self.index is not None:
+            return iter(self.index)
+        return (self.key_table[idx] for idx in range(len(self.key_table)))
+
+
+    def items(self) -> Iterator[Tuple[Any, float]]:
+        return zip(self.keys(), self.values)
+
+
+# Return (weights, numIters). With `read_only` the weights stay memory-mapped, otherwise they are loaded into a
+# `WeightStore` for training.
+def loadCheckpoint(path: str, read_only=False) -> Tuple[Union[WeightStore, MappedWeights], int]:
+    mapped = MappedWeights(path)
+    if read_only:
+        return mapped, mapped.num_iters
+
+    weights = WeightStore()
+    for key in mapped.keys():
+        weights.interner.intern(key)
+    weights.values.frombytes(mapped.values.tobytes())
+    mapped.close()
+    return weights, mapped.num_iters
\ No newline at end of file
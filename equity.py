@@ -0,0 +1,222 @@
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+import math
+import os
+import struct
+import sys
+
+import numpy as np
+
+from game_state import State, Action, publicCode, kStreetCards
+from poker_deck import PokerDeck, kDefaultVariant
+import hand_evaluator
+
+
+# All-in equity of a hand, i.e. its share of the pot when every card is dealt and nobody folds. Ties count as a
+# fraction of a win. Cards use the standard 52 card layout of `hand_evaluator`.
+#
+# - Pre-flop equity vs. 1~kMaxOpponents random hands is read from a precomputed table of the 169 canonical
+#   classes (AA, AKs, AKo, ...), shipped as `preflop_equity.bin`. Rebuild it with `python -m equity --build`.
+# - Any other (hand, board, dead cards) query is estimated by Monte Carlo, drawing batches until the standard error
+#   is below the target. Results are cached on the suit-canonical form of the query, since relabeling the suits
+#   never changes the equity.
+#
+# preflop_equity.bin: | magic | classes: u32 | max opponents: u32 | trials: u32 | float32 equity[classes][max opponents] |
+
+kMagic = b'THEQTY1\0'
+kHeader = struct.Struct('<8sIII')
+kNumClasses = 169
+kMaxOpponents = 9
+kTableTrials = 20000  # Standard error below 0.0036 for every entry.
+kTableFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preflop_equity.bin')
+
+
+class EquityEstimate(NamedTuple):
+    equity: float
+    std_error: float
+    trials: int
+
+
+# Index of the 13x13 grid of pre-flop classes: pairs on the diagonal, suited hands above it (row = high rank) and
+# off-suit hands below it (row = low rank).
+def preflopClass(card_1: int, card_2: int) -> int:
+    rank_1, rank_2 = card_1 % hand_evaluator.kNumRanks, card_2 % hand_evaluator.kNumRanks
+    high, low = max(rank_1, rank_2), min(rank_1, rank_2)
+    if card_1 // hand_evaluator.kNumRanks == card_2 // hand_evaluator.kNumRanks:
+        return high * hand_evaluator.kNumRanks + low
+    return low * hand_evaluator.kNumRanks + high
+
+
+def className(hand_class: int) -> str:
+    row, column = divmod(hand_class, hand_evaluator.kNumRanks)
+    ranks = PokerDeck('full').kRanks
+    if row == column:
+        return ranks[row] * 2
+    return f'{ranks[row]}{ranks[column]}s' if row > column else f'{ranks[column]}{ranks[row]}o'
+
+
+# A hand of the class, in the standard layout.
+def classHand(hand_class: int) -> Tuple[int, int]:
+    row, column = divmod(hand_class, hand_evaluator.kNumRanks)
+    if row > column:  # Suited
+        return row, column
+    return row, hand_evaluator.kNumRanks + column
+
+
+# Equity of each trial with shape (trials,), the random cards are drawn without replacement for every trial.
+# `variant` is the deck the cards are drawn from (still in the standard layout), `board_size` the public cards at the
+# showdown.
+def sampleEquities(rng: np.random.Generator, hand: Sequence[int], board: Sequence[int], dead: Sequence[int], opponents: int, trials: int,
+                   variant='full', board_size=5) -> np.ndarray:
+    deck = PokerDeck(variant)
+    remaining = np.setdiff1d([deck.standardCard(card) for card in range(deck.size)], list(hand) + list(board) + list(dead))
+    missing = board_size - len(board)
+    draws = rng.permuted(np.tile(remaining, (trials, 1)), axis=1)[:, :missing + 2 * opponents]
+    boards = np.concatenate((np.tile(np.array(board, dtype=np.int64), (trials, 1)), draws[:, :missing]), axis=1)
+
+    hero = hand_evaluator.evaluateBatch(np.concatenate((np.tile(np.array(hand, dtype=np.int64), (trials, 1)), boards), axis=1))
+    villains = np.stack([hand_evaluator.evaluateBatch(np.concatenate((draws[:, missing + 2 * k:missing + 2 * k + 2], boards), axis=1))
+                         for k in range(opponents)], axis=1)
+    best = villains.max(axis=1)
+    ties = (villains == hero[:, None]).sum(axis=1)
+    return np.where(hero > best, 1.0, np.where(hero == best, 1.0 / (ties + 1), 0.0))
+
+
+# Draw `batch` trials at a time until the standard error is at most `target_error` or `max_trials` is reached.
+def monteCarloEquity(hand: Sequence[int], board: Sequence[int] = (), dead: Sequence[int] = (), opponents=1,
+                     target_error=0.005, max_trials=200000, batch=2000, seed: Optional[int] = None, variant='full', board_size=5) -> EquityEstimate:
+    rng = np.random.default_rng(seed)
+    total = 0.0
+    total_squares = 0.0
+    trials = 0
+    std_error = math.inf
+    while trials < max_trials:
+        equities = sampleEquities(rng, hand, board, dead, opponents, min(batch, max_trials - trials), variant, board_size)
+        total += float(equities.sum())
+        total_squares += float(np.square(equities).sum())
+        trials += len(equities)
+        mean = total / trials
+        std_error = math.sqrt(max(total_squares / trials - mean * mean, 0.0) / max(trials - 1, 1))
+        if std_error <= target_error:
+            break
+    return EquityEstimate(total / trials, std_error, trials)
+
+
+# The same query with the suits relabeled in order of first appearance (hand, then board, then dead cards, high
+# ranks first), so that equivalent queries usually share one cache entry. A query missing its canonical form only
+# costs a cache miss, the equity doesn't depend on the suit labels.
+def canonicalize(hand: Sequence[int], board: Sequence[int] = (), dead: Sequence[int] = ()) -> Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]:
+    suits: Dict[int, int] = {}
+    def relabel(cards):
+        relabeled = []
+        for card in sorted(cards, key=lambda card: -(card % hand_evaluator.kNumRanks)):
+            suit = suits.setdefault(card // hand_evaluator.kNumRanks, len(suits))
+            relabeled.append(suit * hand_evaluator.kNumRanks + card % hand_evaluator.kNumRanks)
+        return tuple(sorted(relabeled))
+    return relabel(hand), relabel(board), relabel(dead)
+
+
+# The random draws are seeded by the query, so a cached result is also reproducible.
+@lru_cache(maxsize=1 << 16)
+def _cachedEquity(hand: Tuple[int, ...], board: Tuple[int, ...], dead: Tuple[int, ...], opponents: int, target_error: float,
+                  variant: str, board_size: int) -> EquityEstimate:
+    return monteCarloEquity(hand, board, dead, opponents, target_error, seed=hash((hand, board, dead, opponents)) & 0xFFFFFFFF,
+                            variant=variant, board_size=board_size)
+
+
+# Lazily loaded table with shape (kNumClasses, max opponents).
+_preflop_table = None
+
+
+def buildPreflopTable(max_opponents=kMaxOpponents, trials=kTableTrials, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    table = np.zeros((kNumClasses, max_opponents), dtype=np.float32)
+    for hand_class in range(kNumClasses):
+        for opponents in range(1, max_opponents + 1):
+            table[hand_class, opponents - 1] = sampleEquities(rng, classHand(hand_class), (), (), opponents, trials).mean()
+    return table
+
+
+def savePreflopTable(table: np.ndarray, trials: int, path: str = kTableFile) -> None:
+    with open(path, 'wb') as file:
+        file.write(kHeader.pack(kMagic, table.shape[0], table.shape[1], trials))
+        file.write(table.astype('<f4').tobytes())
+
+
+def loadPreflopTable(path: str = kTableFile) -> np.ndarray:
+    global _preflop_table
+    with open(path, 'rb') as file:
+        magic, classes, max_opponents, _ = kHeader.unpack(file.read(kHeader.size))
+        if magic != kMagic:
+            raise ValueError(f'{path} is not a pre-flop equity table')
+        _preflop_table = np.frombuffer(file.read(), dtype='<f4').reshape(classes, max_opponents).astype(np.float32)
+    return _preflop_table
+
+
+def preflopEquity(card_1: int, card_2: int, opponents=1) -> float:
+    if _preflop_table is None:
+        loadPreflopTable()
+    return float(_preflop_table[preflopClass(card_1, card_2), opponents - 1])
+
+
+# Equity of `hand` vs. `opponents` random hands, given the public `board` and the known `dead` cards. The cards are
+# in the standard layout, a reduced deck `variant` only changes the cards left to draw (see `sampleEquities()`).
+def equity(hand: Sequence[int], board: Sequence[int] = (), dead: Sequence[int] = (), opponents=1, target_error=0.005,
+           variant='full', board_size=5) -> float:
+    if not board and not dead and 1 <= opponents <= kMaxOpponents and variant == 'full' and board_size == 5:
+        return preflopEquity(hand[0], hand[1], opponents)
+    return _cachedEquity(*canonicalize(hand, board, dead), opponents, target_error, variant, board_size).equity
+
+
+
+# Equity in the one card pre-flop game of `TexasHoldemSimulator` (see `winningHand()`): every player holds one card
+# of the reduced deck, and the highest rank wins. Exact, in closed form: the opponents' cards are a random subset of
+# the other cards, so the chance that `ties` of them hold my rank and the rest lower ranks is hypergeometric.
+@lru_cache(maxsize=None)
+def oneCardEquity(variant: str, card: int, opponents: int) -> float:
+    deck = PokerDeck(variant)
+    rank = card % len(deck.kRanks)
+    lower = rank * len(deck.kSuits)
+    equal = len(deck.kSuits) - 1
+    deals = math.comb(deck.size - 1, opponents)
+    return sum(math.comb(equal, ties) * math.comb(lower, opponents - ties) / (ties + 1) for ties in range(min(equal, opponents) + 1)) / deals
+
+
+# Pack (my_id, equity bucket, public information, action) into a single int, like `encodeIdentityFeature()`:
+# | publicCode() | my_id: 4 bits | bucket: 5 bits | action: 2 bits |
+def encodeEquityFeature(my_id: int, bucket: int, public_code: int, action: Action) -> int:
+    return ((public_code << 4 | my_id) << 5 | bucket) << 2 | action.value
+
+
+# Feature extractor keyed on the equity bucket of the hand instead of the cards, so hands of similar strength share
+# their weights. The one card game of the simulator (the hand is one card twice) is enumerated exactly. Two card hands
+# use their pre-flop equity to the showdown of the game with `streets`: the table for the full deck, Monte Carlo on
+# the reduced decks. It is a class rather than a closure so the agent can still be pickled, see parallel_training.py.
+class EquityFeatureExtractor:
+    def __init__(self, variant=kDefaultVariant, buckets=10, streets=4):
+        assert buckets <= 32
+        self.deck = PokerDeck(variant)
+        self.buckets = buckets
+        self.board_size = sum(kStreetCards[:streets])
+
+    def __call__(self, state: State, action: Action) -> list:
+        card_1, card_2 = state.exclusive.my_hand
+        if card_1 == card_2:
+            value = oneCardEquity(self.deck.variant, card_1, state.public.players - 1)
+        else:
+            hand = (self.deck.standardCard(card_1), self.deck.standardCard(card_2))
+            value = equity(hand, opponents=state.public.players - 1, variant=self.deck.variant, board_size=self.board_size)
+        bucket = min(int(value * self.buckets), self.buckets - 1)
+        return [(encodeEquityFeature(state.exclusive.my_id, bucket, publicCode(state.public), action), 1)]
+
+
+def main(argv):
+    if '--build' in argv:
+        savePreflopTable(buildPreflopTable(), kTableTrials)
+    table = loadPreflopTable()
+    for hand_class in sorted(range(kNumClasses), key=lambda idx: -table[idx, 0]):
+        print(f'{className(hand_class):<4}', ' '.join(f'{value:.3f}' for value in table[hand_class]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
\ No newline at end of file
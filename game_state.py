@@ -1,5 +1,7 @@
 from enum import Enum, unique
-from typing import List, Tuple
+import weakref
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
 from poker_deck import PokerDeck
 
 @unique
@@ -10,41 +12,226 @@ class Action(Enum):
     RAISE = 3  # Equivalent to `bet`
 
 
+# An action in the history is encoded as a small int: (player_id << 2) | action.value
+# NOTE: The history keeps 6 bits per action, so the player ids must fit in 4 bits.
+kMaxPlayers = 16
+
+
+def encodeAction(player_id: int, action: Action) -> int:
+    return (player_id << 2) | action.value
+
+
+def decodeAction(code: int) -> Tuple[int, Action]:
+    return code >> 2, Action(code & 3)
+
+
+kRecentHistories = 1 << 16
+
+
+# Persistent action history. Each node points to its parent, so appending an action is O(1) and the history is
+# shared by every snapshot instead of copied. The whole history is also encoded as an int, 6 bits per action code.
+# Nodes are interned by this code: equal histories are the same object, so hashing and comparing is by identity.
+# The intern table holds the nodes weakly, a history no state refers to anymore is freed. The `recent` nodes are also
+# held strongly so the common histories are not rebuilt every hand, that cache is cleared when it reaches
+# `kRecentHistories` nodes.
+class ActionHistory:
+    __slots__ = ('parent', 'player', 'action', 'code', 'length', '__weakref__')
+    interned: 'weakref.WeakValueDictionary[int, ActionHistory]' = weakref.WeakValueDictionary()
+    recent: Dict[int, 'ActionHistory'] = {}
+
+    def __init__(self, parent: Optional['ActionHistory'], action_code: int):
+        self.parent = parent
+        self.player = action_code >> 2
+        self.action = Action(action_code & 3) if parent is not None else None
+        self.code = (parent.code << 6 | action_code) if parent is not None else 0
+        self.length = parent.length + 1 if parent is not None else 0
+
+
+    def appendCode(self, action_code: int) -> 'ActionHistory':
+        code = self.code << 6 | action_code
+        node = ActionHistory.recent.get(code)
+        if node is None:
+            node = ActionHistory.interned.get(code)
+            if node is None:
+                node = ActionHistory(self, action_code)
+                ActionHistory.interned[code] = node
+            if len(ActionHistory.recent) >= kRecentHistories:
+                ActionHistory.recent.clear()
+            ActionHistory.recent[code] = node
+        return node
+
+
+    def append(self, player_id: int, action: Action) -> 'ActionHistory':
+        return self.appendCode(encodeAction(player_id, action))
+
+
+    # Iterate the (player_id, action) pairs from the first action.
+    def __iter__(self) -> Iterator[Tuple[int, Action]]:
+        actions = []
+        node = self
+        while node.parent is not None:
+            actions.append((node.player, node.action))
+            node = node.parent
+        return reversed(actions)
+
+
+    def __len__(self) -> int:
+        return self.length
+
+
+    # Unpickle through `historyFromCode()` to keep the nodes interned.
+    def __reduce__(self):
+        return historyFromCode, (self.code,)
+
+
+    def __repr__(self) -> str:
+        return f'ActionHistory({list(self)})'
+
+
+kEmptyHistory = ActionHistory(None, 0)
+ActionHistory.interned[0] = kEmptyHistory
+
+
+def historyFromCode(code: int) -> ActionHistory:
+    action_codes = []
+    while code:
+        action_codes.append(code & 0x3F)
+        code >>= 6
+    history = kEmptyHistory
+    for action_code in reversed(action_codes):
+        history = history.appendCode(action_code)
+    return history
+
+
+# Betting rounds of a hand, `PublicState.street` is the current one.
+kPreFlop, kFlop, kTurn, kRiver = range(4)
+kStreetNames = ['PreFlop', 'Flop', 'Turn', 'River']
+kStreetCards = [0, 3, 1, 1]  # Public cards dealt at the start of each street.
+
+
 # These attributes will be different for each player:
 class ExclusiveState:
+    __slots__ = ('my_id', 'my_hand', 'chips')
+
     def __init__(self, id: int, hand: Tuple[int, int], buy_in=0):
         self.my_id = id
         self.my_hand = hand
         self.chips = buy_in
 
 
+    # The hand tuple is shared, only the chips may change after the snapshot.
+    def snapshot(self) -> 'ExclusiveState':
+        return ExclusiveState(self.my_id, self.my_hand, self.chips)
+
+
 # These attributes will be the same for every player since these are public information:
 class PublicState:
+    __slots__ = ('players', 'street', 'preflop_actions', 'flop_actions', 'turn_actions', 'river_actions', 'cards', 'pot', 'current_bet', 'players_bet')
+
     def __init__(self, total_players: int):
         self.players = total_players
-        self.preflop_actions = tuple()
-        self.cards = tuple()  # The public cards on the table. 5 maximum. # TODO: Not used for simplified game.
-        # TODO: self.flop_actions = tuple()
-        # TODO: self.turn_actions = tuple()
-        # TODO: self.river_actions = tuple()
+        self.street = kPreFlop
+        self.preflop_actions = kEmptyHistory
+        self.flop_actions = kEmptyHistory
+        self.turn_actions = kEmptyHistory
+        self.river_actions = kEmptyHistory
+        self.cards = tuple()  # The public cards on the table. 5 maximum. Empty for the pre-flop only game.
 
         # The following elements are derived from actions, for helping calculate the amount call/raise. It won't increase the number of states.
+        # NOTE: They are totals of the whole hand, not of the street, so nothing is reset between streets.
         self.pot = 0
         self.current_bet = 0
         self.players_bet = [0] * self.players
 
 
+    # Immutable copy of the public state: the action history and the cards are shared, `players_bet` becomes a tuple.
+    def snapshot(self) -> 'PublicState':
+        public = PublicState.__new__(PublicState)
+        public.players = self.players
+        public.street = self.street
+        public.preflop_actions = self.preflop_actions
+        public.flop_actions = self.flop_actions
+        public.turn_actions = self.turn_actions
+        public.river_actions = self.river_actions
+        public.cards = self.cards
+        public.pot = self.pot
+        public.current_bet = self.current_bet
+        public.players_bet = tuple(self.players_bet)
+        return public
+
+
+    # Record an action in the history of the current street.
+    def appendAction(self, player_id: int, action: Action) -> None:
+        if self.street == kPreFlop:
+            self.preflop_actions = self.preflop_actions.append(player_id, action)
+        elif self.street == kFlop:
+            self.flop_actions = self.flop_actions.append(player_id, action)
+        elif self.street == kTurn:
+            self.turn_actions = self.turn_actions.append(player_id, action)
+        else:
+            self.river_actions = self.river_actions.append(player_id, action)
+
+
+    def streetActions(self) -> List[ActionHistory]:
+        return [self.preflop_actions, self.flop_actions, self.turn_actions, self.river_actions][:self.street + 1]
+
+
+# The public information of a decision as an int: the actions of every street so far and the board, 6 bits per item
+# like `ActionHistory.code`:
+# | preflop actions | 0 | flop cards | flop actions | 0 | turn card | turn actions | 0 | river card | river actions |
+# An item 0 starts the next street (an action code is never 0) and is followed by the cards dealt on that street.
+# Before the flop it is just `preflop_actions.code`.
+def publicCode(public: PublicState) -> int:
+    code = public.preflop_actions.code
+    if public.street == kPreFlop:
+        return code
+    cards = public.cards
+    dealt = 0
+    for street, history in enumerate(public.streetActions()[kFlop:], kFlop):
+        code <<= 6
+        for card in cards[dealt:dealt + kStreetCards[street]]:
+            code = code << 6 | card
+        dealt += kStreetCards[street]
+        code = code << 6 * len(history) | history.code
+    return code
+
+
+# Return (street, action history of each street, board cards) of a `publicCode()`.
+def decodePublicCode(code: int) -> Tuple[int, List[ActionHistory], Tuple[int, ...]]:
+    items = [(code >> shift) & 0x3F for shift in range(6 * ((code.bit_length() + 5) // 6 - 1), -1, -6)]
+    histories = [kEmptyHistory] * (kRiver + 1)
+    cards: List[int] = []
+    street = kPreFlop
+    idx = 0
+    while idx < len(items):
+        if items[idx] == 0:
+            street += 1
+            cards += items[idx + 1:idx + 1 + kStreetCards[street]]
+            idx += 1 + kStreetCards[street]
+        else:
+            histories[street] = histories[street].appendCode(items[idx])
+            idx += 1
+    return street, histories, tuple(cards)
+
+
 
 class State:
+    __slots__ = ('exclusive', 'public')
+
     def __init__(self, exclusive: ExclusiveState, public: PublicState):
         self.exclusive = exclusive
         self.public = public
 
+
+    # Snapshot handed to the agents, it is much cheaper than `deepcopy()`.
+    def snapshot(self) -> 'State':
+        return State(self.exclusive.snapshot(), self.public.snapshot())
+
     
     def print(self, deck: PokerDeck) -> None:
         player_color = f'\u001b[{31+self.exclusive.my_id};1m'
         print(player_color + f'State of Player {self.exclusive.my_id}: ' + deck.printCards(list(self.exclusive.my_hand)) + ' Actions: ', end='')
-        print(player_color + ' '.join([f'{player}:{action.name}' for player, action in self.public.preflop_actions]) + '\u001b[0m')
+        print(player_color + ' | '.join([' '.join([f'{player}:{action.name}' for player, action in history]) for history in self.public.streetActions()]) + '\u001b[0m')
         
 
     def getCallCost(self) -> int:
@@ -60,6 +247,7 @@ class State:
     # Simulate the action history to compute the next cost for CALL or RAISE
     # Returned tuple: (cost of CALL, cost of RAISE, current pot size)
     # NOTE: This function is not currently used. But keep their for good sanity check.
+    # NOTE: It only replays `preflop_actions` with unlimited stacks, the simulator keeps the costs incrementally.
     def getCostBySimulation(self) -> Tuple[int, int, int]:
         player_bet = [0] * self.public.players
         current_bet = 0
@@ -92,4 +280,75 @@ class State:
 
 def getActions(state: State) -> List[Action]:
     # TODO: Check preflop_actions to limit number of raise
-    return [action for action in Action]
\ No newline at end of file
+    return [action for action in Action]
+
+
+
+# A batch of states, one row for each hand played in lockstep by `BatchTexasHoldemSimulator`.
+# The attributes are views of the simulator arrays selected by `rows`, they are only gathered when accessed.
+class BatchState:
+    def __init__(self, rows: np.ndarray, actor: np.ndarray, hands: np.ndarray, pot: np.ndarray, current_bet: np.ndarray,
+                 players_bet: np.ndarray, actions: np.ndarray, num_actions: np.ndarray, rng: np.random.Generator):
+        self.rows = rows
+        self._actor = actor
+        self._hands = hands
+        self._pot = pot
+        self._current_bet = current_bet
+        self._players_bet = players_bet
+        self._actions = actions
+        self._num_actions = num_actions
+        self.rng = rng  # Random generator for stochastic agents.
+
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def my_id(self) -> np.ndarray:
+        return self._actor[self.rows]
+
+    @property
+    def my_hand(self) -> np.ndarray:
+        return self._hands[self.rows, self.my_id]
+
+    @property
+    def pot(self) -> np.ndarray:
+        return self._pot[self.rows]
+
+    @property
+    def current_bet(self) -> np.ndarray:
+        return self._current_bet[self.rows]
+
+    @property
+    def players_bet(self) -> np.ndarray:
+        return self._players_bet[self.rows]
+
+    # Action history codes (see `encodeAction()`), only the first `num_actions` columns are valid.
+    @property
+    def actions(self) -> np.ndarray:
+        return self._actions[self.rows]
+
+    @property
+    def num_actions(self) -> np.ndarray:
+        return self._num_actions[self.rows]
+
+
+    def getCallCost(self) -> np.ndarray:
+        return self.current_bet - self._players_bet[self.rows, self.my_id]
+
+
+    def getRaiseCost(self) -> np.ndarray:
+        return np.rint((self.pot + self.getCallCost()) * 0.5).astype(np.int64)  # NOTE: rint rounds half to even as `round()`.
+
+
+    # Build the scalar `State` of the i-th row, for agents without a batched `getActions()`.
+    def getState(self, i: int) -> State:
+        row = self.rows[i]
+        my_id = int(self._actor[row])
+        public = PublicState(self._players_bet.shape[1])
+        for code in self._actions[row, :self._num_actions[row]].tolist():
+            public.preflop_actions = public.preflop_actions.appendCode(code)
+        public.pot = int(self._pot[row])
+        public.current_bet = int(self._current_bet[row])
+        public.players_bet = self._players_bet[row].tolist()
+        return State(ExclusiveState(my_id, tuple(self._hands[row, my_id].tolist())), public)  # type: ignore
\ No newline at end of file
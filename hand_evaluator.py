@@ -0,0 +1,181 @@
+from itertools import combinations_with_replacement
+from typing import List, Sequence, Tuple
+import os
+
+import numpy as np
+
+
+# Table driven hand evaluator for 5, 6 or 7 cards.
+#
+# Cards use the standard deck layout of `PokerDeck`: card = suit * 13 + rank, rank 0 is '2' and rank 12 is 'A'.
+# A hand value is an int where a bigger value is a better hand:
+#   value = category << 20 | kicker_1 << 16 | kicker_2 << 12 | kicker_3 << 8 | kicker_4 << 4 | kicker_5
+#
+# Two tables are precomputed once and cached on disk:
+# - Rank table: the best non-flush value for every multiset of 5~7 ranks. The multiset is keyed by the sum of
+#   5 ** rank over the cards, which is unique since a rank appears at most 4 times.
+# - Flush table: the best flush (or straight flush) value for every 13-bit rank mask.
+# A flush can never coexist with quads or a full house within 7 cards, so the hand value is simply the max of both.
+
+kNumRanks = 13
+kNumSuits = 4
+kCategories = ['High Card', 'One Pair', 'Two Pair', 'Three of a Kind', 'Straight', 'Flush', 'Full House', 'Four of a Kind', 'Straight Flush']
+HIGH_CARD, ONE_PAIR, TWO_PAIR, THREE_OF_A_KIND, STRAIGHT, FLUSH, FULL_HOUSE, FOUR_OF_A_KIND, STRAIGHT_FLUSH = range(len(kCategories))
+
+kTableFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hand_rank_tables.npz')
+
+# Per card lookups, so evaluating a hand is only a few additions and table reads.
+kRankKey = [5 ** (card % kNumRanks) for card in range(kNumRanks * kNumSuits)]
+kRankBit = [1 << (card % kNumRanks) for card in range(kNumRanks * kNumSuits)]
+kSuitKey = [1 << (4 * (card // kNumRanks)) for card in range(kNumRanks * kNumSuits)]  # 4 bits counter for each suit.
+
+
+def makeValue(category: int, kickers: Sequence[int]) -> int:
+    value = category
+    for i in range(5):
+        value = (value << 4) | (kickers[i] if i < len(kickers) else 0)
+    return value
+
+
+# Return the highest rank of a straight in the rank mask, or -1 if there is none.
+def straightHigh(mask: int) -> int:
+    for high in range(kNumRanks - 1, 3, -1):
+        if (mask >> (high - 4)) & 0x1F == 0x1F:
+            return high
+    if mask & 0x100F == 0x100F:  # A-2-3-4-5, the wheel.
+        return 3
+    return -1
+
+
+# The best 5 card value using only the ranks, i.e. ignoring flushes.
+def bestRankValue(counts: List[int]) -> int:
+    ranks = [rank for rank in range(kNumRanks - 1, -1, -1) if counts[rank] > 0]  # Distinct ranks, high to low.
+    quads = [rank for rank in ranks if counts[rank] == 4]
+    trips = [rank for rank in ranks if counts[rank] == 3]
+    pairs = [rank for rank in ranks if counts[rank] == 2]
+
+    if quads:
+        return makeValue(FOUR_OF_A_KIND, [quads[0], next(rank for rank in ranks if rank != quads[0])])
+    if trips and (len(trips) > 1 or pairs):
+        pair = max([rank for rank in trips[1:] + pairs])
+        return makeValue(FULL_HOUSE, [trips[0], pair])
+    high = straightHigh(sum(1 << rank for rank in ranks))
+    if high >= 0:
+        return makeValue(STRAIGHT, [high])
+    if trips:
+        return makeValue(THREE_OF_A_KIND, [trips[0]] + [rank for rank in ranks if rank != trips[0]][:2])
+    if len(pairs) >= 2:
+        return makeValue(TWO_PAIR, pairs[:2] + [rank for rank in ranks if rank not in pairs[:2]][:1])
+    if pairs:
+        return makeValue(ONE_PAIR, [pairs[0]] + [rank for rank in ranks if rank != pairs[0]][:3])
+    return makeValue(HIGH_CARD, ranks[:5])
+
+
+# The best flush value for a 13-bit mask of suited ranks (at least 5 bits set).
+def bestFlushValue(mask: int) -> int:
+    high = straightHigh(mask)
+    if high >= 0:
+        return makeValue(STRAIGHT_FLUSH, [high])
+    return makeValue(FLUSH, [rank for rank in range(kNumRanks - 1, -1, -1) if mask >> rank & 1][:5])
+
+
+def buildTables() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    keys = []
+    values = []
+    for num_cards in range(5, 8):
+        for ranks in combinations_with_replacement(range(kNumRanks), num_cards):
+            counts = [0] * kNumRanks
+            for rank in ranks:
+                counts[rank] += 1
+            if max(counts) > 4:
+                continue
+            keys.append(sum(5 ** rank for rank in ranks))
+            values.append(bestRankValue(counts))
+    order = np.argsort(keys)
+    rank_keys = np.array(keys, dtype=np.int64)[order]
+    rank_values = np.array(values, dtype=np.int32)[order]
+
+    flush_values = np.zeros(1 << kNumRanks, dtype=np.int32)
+    for mask in range(1 << kNumRanks):
+        if bin(mask).count('1') >= 5:
+            flush_values[mask] = bestFlushValue(mask)
+    return rank_keys, rank_values, flush_values
+
+
+# Lazily loaded tables, shared by the whole process.
+_rank_keys = None
+_rank_values = None
+_flush_values = None
+_rank_table = {}        # Rank key -> value, for the scalar API.
+_flush_table = []       # Rank mask -> value, for the scalar API.
+_flush_suit = []        # Suit key -> suit with >= 5 cards or -1, for the scalar API.
+_mask_rank_key = []     # 13-bit rank mask of one suit -> its part of the rank key, for `evaluateMask()`.
+
+
+def loadTables(path: str = kTableFile) -> None:
+    global _rank_keys, _rank_values, _flush_values, _rank_table, _flush_table, _flush_suit, _mask_rank_key
+    if os.path.exists(path):
+        with np.load(path) as tables:
+            _rank_keys, _rank_values, _flush_values = tables['rank_keys'], tables['rank_values'], tables['flush_values']
+    else:
+        _rank_keys, _rank_values, _flush_values = buildTables()
+        try:
+            np.savez(path, rank_keys=_rank_keys, rank_values=_rank_values, flush_values=_flush_values)
+        except OSError:
+            pass  # Read-only install, the tables will be rebuilt next time.
+
+    _rank_table = dict(zip(_rank_keys.tolist(), _rank_values.tolist()))
+    _flush_table = _flush_values.tolist()
+    _flush_suit = [-1] * (1 << (4 * kNumSuits))
+    for suit_key in range(len(_flush_suit)):
+        for suit in range(kNumSuits):
+            if (suit_key >> (4 * suit)) & 0xF >= 5:
+                _flush_suit[suit_key] = suit
+    _mask_rank_key = [sum(5 ** rank for rank in range(kNumRanks) if mask >> rank & 1) for mask in range(1 << kNumRanks)]
+
+
+# Rank a single hand of 5~7 cards.
+def evaluate(cards: Sequence[int]) -> int:
+    if _rank_keys is None:
+        loadTables()
+    value = _rank_table[sum([kRankKey[card] for card in cards])]
+    flush_suit = _flush_suit[sum([kSuitKey[card] for card in cards])]
+    if flush_suit >= 0:
+        mask = sum([kRankBit[card] for card in cards if card // kNumRanks == flush_suit])
+        value = max(value, _flush_table[mask])
+    return value
+
+
+# Rank a hand of 5~7 cards given as a 52-bit mask, bit `card` set for each card (see `PokerDeck.cardsMask()`).
+# Each 13-bit suit slice is its own flush table key, so no per card work is needed.
+def evaluateMask(mask: int) -> int:
+    if _rank_keys is None:
+        loadTables()
+    spades, hearts, clubs, diamonds = mask & 0x1FFF, mask >> 13 & 0x1FFF, mask >> 26 & 0x1FFF, mask >> 39 & 0x1FFF
+    value = _rank_table[_mask_rank_key[spades] + _mask_rank_key[hearts] + _mask_rank_key[clubs] + _mask_rank_key[diamonds]]
+    return max(value, _flush_table[spades], _flush_table[hearts], _flush_table[clubs], _flush_table[diamonds])
+
+
+# Rank many hands in one call. `cards` is an int array with shape (num_hands, 5~7).
+def evaluateBatch(cards: np.ndarray) -> np.ndarray:
+    if _rank_keys is None:
+        loadTables()
+    cards = np.asarray(cards, dtype=np.int64)
+    ranks = cards % kNumRanks
+    suits = cards // kNumRanks
+
+    rank_keys = (np.int64(5) ** ranks).sum(axis=1)
+    values = _rank_values[np.searchsorted(_rank_keys, rank_keys)]
+
+    suit_counts = (suits[:, :, None] == np.arange(kNumSuits)).sum(axis=1)
+    flush_suit = suit_counts.argmax(axis=1)
+    has_flush = suit_counts.max(axis=1) >= 5
+    if has_flush.any():
+        in_flush = (suits == flush_suit[:, None]) & has_flush[:, None]
+        masks = np.where(in_flush, np.int64(1) << ranks, 0).sum(axis=1)
+        values = np.maximum(values, _flush_values[masks])
+    return values
+
+
+def handCategory(value: int) -> str:
+    return kCategories[value >> 20]
\ No newline at end of file
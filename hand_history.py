@@ -0,0 +1,234 @@
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+import os
+import random
+import struct
+
+from learning_agent import LearningAgent, QLearningAgent, HashedQLearningAgent
+from game_state import State, Action, encodeAction, decodeAction
+from poker_deck import kDefaultVariant
+from instrumentation import SimulatorHooks
+from simulator import TexasHoldemSimulator
+
+
+# Compact hand history log:
+#
+# | magic | deck variant: 8 bytes, NUL padded | streets: u8 | seats: u8 | stack of each seat: u32 each | record | record | ...
+#
+# The header holds the game settings of the simulator (see `TexasHoldemSimulator`), a replay needs them to deal the
+# same cards and bet the same amounts. A stack of 0 is unlimited.
+# Each record is length-prefixed (uint32) and holds one hand:
+# | players: u8 | dealer_id: u8 | dealt: u8 | actions: u16 | dealt cards: u8 each | action codes: u8 each | payoffs: f64 each |
+# The dealt cards are in dealing order, so stacking a deck with them replays the deal. The action codes come from
+# `encodeAction()` and include the blinds. All numbers are little-endian.
+
+kMagic = b'THHIST2\n'
+kMagicV1 = b'THHIST1\n'  # Logs without the header, recorded with `streets = 1`, `stack = 0` and an unknown deck variant.
+kLogHeader = struct.Struct('<8sBB')
+kLength = struct.Struct('<I')
+kRecordHeader = struct.Struct('<BBBH')
+
+
+class HandRecord(NamedTuple):
+    players: int
+    dealer_id: int
+    dealt: Tuple[int, ...]
+    actions: Tuple[int, ...]   # Action codes, see `decodeAction()`.
+    payoffs: Tuple[float, ...]
+    variant: Optional[str] = None  # From the log header, None for a version 1 log.
+    streets: int = 1
+    stacks: Tuple[int, ...] = ()
+
+
+def encodeRecord(record: HandRecord) -> bytes:
+    payload = kRecordHeader.pack(record.players, record.dealer_id, len(record.dealt), len(record.actions)) \
+            + bytes(record.dealt) + bytes(record.actions) + struct.pack(f'<{record.players}d', *record.payoffs)
+    return kLength.pack(len(payload)) + payload
+
+
+def decodeRecord(payload: bytes, variant: Optional[str] = None, streets=1, stacks: Tuple[int, ...] = ()) -> HandRecord:
+    players, dealer_id, num_dealt, num_actions = kRecordHeader.unpack_from(payload)
+    offset = kRecordHeader.size
+    dealt = tuple(payload[offset:offset + num_dealt])
+    offset += num_dealt
+    actions = tuple(payload[offset:offset + num_actions])
+    offset += num_actions
+    return HandRecord(players, dealer_id, dealt, actions, struct.unpack_from(f'<{players}d', payload, offset), variant, streets, stacks)
+
+
+def encodeLogHeader(variant: str, streets: int, stacks: Sequence[int]) -> bytes:
+    return kLogHeader.pack(variant.encode(), streets, len(stacks)) + struct.pack(f'<{len(stacks)}I', *stacks)
+
+
+# Return (variant, streets, stacks) of an open log positioned at the start.
+def readLogHeader(file, path: str) -> Tuple[Optional[str], int, Tuple[int, ...]]:
+    magic = file.read(len(kMagic))
+    if magic == kMagicV1:
+        return None, 1, ()
+    if magic != kMagic:
+        raise ValueError(f'{path} is not a hand history log')
+    variant, streets, seats = kLogHeader.unpack(file.read(kLogHeader.size))
+    return variant.rstrip(b'\0').decode(), streets, struct.unpack(f'<{seats}I', file.read(4 * seats))
+
+
+# Settings compared when appending to a log. Unlimited stacks are the same whatever the number of seats, e.g. in a
+# version 1 log.
+def logSettings(streets: int, stacks: Tuple[int, ...]) -> Tuple[int, Tuple[int, ...]]:
+    return streets, tuple(stacks) if any(stacks) else ()
+
+
+# Simulator hooks streaming every hand to the log. The records are buffered and written `buffer_size` bytes at a time.
+class HandHistoryWriter(SimulatorHooks):
+    def __init__(self, path: str, buffer_size=1 << 16):
+        self.path = path
+        self.is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        self.has_header = False  # The header is written at the first hand, once the simulator is known.
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+        self.hands = 0
+        self.deck = None
+        self.dealer_id = 0
+        self.actions: List[int] = []
+
+
+    def onDeal(self, simulator, deck, exclusive_states):
+        if not self.has_header:
+            self.writeHeader(simulator.deck.variant, simulator.streets, tuple(simulator.stacks))
+        self.deck = deck
+        self.dealer_id = simulator.dealer_id
+        self.actions = []
+
+
+    def onAction(self, simulator, deck, public_state, exclusive_state, action):
+        self.actions.append(encodeAction(exclusive_state.my_id, action))
+
+
+    def onHandEnd(self, simulator, payoffs):
+        self.write(HandRecord(len(payoffs), self.dealer_id, tuple(self.deck.dealt), tuple(self.actions), tuple(payoffs)))
+
+
+    # A new log gets the header, an existing one must have been recorded with the same settings.
+    def writeHeader(self, variant: str, streets: int, stacks: Tuple[int, ...]) -> None:
+        if self.is_new:
+            self.file.write(kMagic + encodeLogHeader(variant, streets, stacks))
+        else:
+            with open(self.path, 'rb') as file:
+                logged_variant, logged_streets, logged_stacks = readLogHeader(file, self.path)
+            # NOTE: The deck variant of a version 1 log is unknown, it is trusted to match.
+            if logged_variant not in (None, variant) or logSettings(logged_streets, logged_stacks) != logSettings(streets, stacks):
+                raise ValueError(f'{self.path} was recorded with other game settings, start a new log')
+        self.has_header = True
+
+
+    def write(self, record: HandRecord) -> None:
+        self.buffer += encodeRecord(record)
+        self.hands += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+    def __enter__(self) -> 'HandHistoryWriter':
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+
+def readHands(path: str) -> Iterator[HandRecord]:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return  # A writer that never saw a hand leaves an empty log.
+        variant, streets, stacks = readLogHeader(file, path)
+        while True:
+            prefix = file.read(kLength.size)
+            if len(prefix) < kLength.size:
+                return  # NOTE: A truncated last record (e.g. after a crash) is ignored.
+            length = kLength.unpack(prefix)[0]
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            yield decodeRecord(payload, variant, streets, stacks)
+
+
+
+# Plays back the recorded actions of one seat, and collects the transitions given to incorporateFeedback().
+class ReplayAgent(LearningAgent):
+    def __init__(self, actions: Sequence[Action], transitions: Optional[List[Tuple[State, Action, float, Optional[State]]]]):
+        self.actions = iter(actions)
+        self.transitions = transitions
+
+    def getAction(self, state: State) -> Action:
+        action = next(self.actions, None)
+        if action is None:
+            raise ValueError('The hand asks for more actions than were recorded')
+        return action
+
+    def incorporateFeedback(self, state: State, action: Action, reward: float, newState: Optional[State]) -> None:
+        if self.transitions is not None:
+            self.transitions.append((state, action, reward, newState))
+
+
+# Rebuild the (state, action, reward, newState) transitions of the given seats by replaying the hand in the simulator.
+# The deck variant comes from the log, `deck_variant` is only needed for a version 1 log and must match otherwise.
+def replayTransitions(record: HandRecord, seats: Iterable[int], deck_variant: Optional[str] = None) -> Dict[int, List[Tuple[State, Action, float, Optional[State]]]]:
+    if record.variant is not None and deck_variant not in (None, record.variant):
+        raise ValueError(f'The hand was recorded with the {record.variant} deck, not {deck_variant}')
+    variant = record.variant or deck_variant or kDefaultVariant
+
+    seat_actions: List[List[Action]] = [[] for _ in range(record.players)]
+    for code in record.actions[2:]:  # Skip the blinds.
+        player, action = decodeAction(code)
+        seat_actions[player].append(action)
+
+    transitions = {seat: [] for seat in seats}
+    agents = [ReplayAgent(seat_actions[id], transitions.get(id)) for id in range(record.players)]
+    simulator = TexasHoldemSimulator(agents, verbose=0, deck_variant=variant, streets=record.streets,  # type: ignore
+                                     stack=list(record.stacks) if record.stacks else 0)
+    simulator.dealer_id = record.dealer_id
+    deck = simulator.deck
+    deck.stack(list(record.dealt))
+    payoffs = simulator.playOneHand(deck)
+    if tuple(payoffs) != record.payoffs:
+        raise ValueError(f'Replayed payoffs {tuple(payoffs)} differ from the recorded {record.payoffs}')
+    return transitions
+
+
+# Train `agent` offline from a log. Transitions of `batch_hands` hands are gathered, shuffled and replayed as a
+# minibatch into `agent.incorporateFeedback()`. `seats` are the seats whose transitions are learned.
+# `deck_variant` is only needed for a version 1 log, see `replayTransitions()`.
+def trainFromHistory(path: str, agent: LearningAgent, seats: Iterable[int] = (0,), batch_hands=256, epochs=1, seed=0, deck_variant: Optional[str] = None) -> int:
+    rng = random.Random(seed)
+    seats = list(seats)
+    updates = 0
+    for _ in range(epochs):
+        batch = []
+        for hands, record in enumerate(readHands(path), 1):
+            for seat_transitions in replayTransitions(record, seats, deck_variant).values():
+                batch.extend(seat_transitions)
+            if hands % batch_hands == 0:
+                updates += replayBatch(agent, batch, rng)
+                batch = []
+        updates += replayBatch(agent, batch, rng)
+    return updates
+
+
+def replayBatch(agent: LearningAgent, batch: List[Tuple[State, Action, float, Optional[State]]], rng: random.Random) -> int:
+    rng.shuffle(batch)
+    for state, action, reward, new_state in batch:
+        if isinstance(agent, (QLearningAgent, HashedQLearningAgent)):
+            agent.numIters += 1  # As getAction() would do in a live game, so the step size keeps decaying.
+        agent.incorporateFeedback(state, action, reward, new_state)
+    return len(batch)
\ No newline at end of file
@@ -0,0 +1,102 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Dict, List
+
+from game_state import State, PublicState, ExclusiveState, Action, kStreetNames
+from poker_deck import PokerDeck
+
+
+# Hooks called by `TexasHoldemSimulator` while a hand is played. The simulator skips the calls entirely when no
+# hook is registered, so the hooks cost nothing in training runs.
+class SimulatorHooks:
+    # The cards are dealt to every player.
+    def onDeal(self, simulator: Any, deck: PokerDeck, exclusive_states: List[ExclusiveState]) -> None: pass
+
+    # A player acted, the blinds are reported as RAISE. `public_state` is already updated with the action.
+    def onAction(self, simulator: Any, deck: PokerDeck, public_state: PublicState, exclusive_state: ExclusiveState, action: Action) -> None: pass
+
+    # A new betting round starts (flop, turn, river), its public cards are already in `public_state.cards`.
+    def onStreet(self, simulator: Any, deck: PokerDeck, public_state: PublicState) -> None: pass
+
+    def onShowdown(self, simulator: Any, winners: List[int]) -> None: pass
+
+    # The pot is paid, `payoffs` is the chip change of each player in this hand.
+    def onHandEnd(self, simulator: Any, payoffs: List[float]) -> None: pass
+
+
+
+# The `verbose = 2` printing of the simulator.
+class VerboseHooks(SimulatorHooks):
+    def onDeal(self, simulator, deck, exclusive_states):
+        for exclusive_state in exclusive_states:
+            print(f'Player_{exclusive_state.my_id}:', deck.printCards(list(exclusive_state.my_hand)))
+
+    def onAction(self, simulator, deck, public_state, exclusive_state, action):
+        print(f'Pot: {public_state.pot}\t', end='')
+        State(exclusive_state, public_state).print(deck)
+
+    def onStreet(self, simulator, deck, public_state):
+        print(f'{kStreetNames[public_state.street]}:', deck.printCards(list(public_state.cards)))
+
+    def onShowdown(self, simulator, winners):
+        print(f'The winners are player {winners}')
+
+    def onHandEnd(self, simulator, payoffs):
+        print(f"Players' chips: {simulator.chips}\n")
+
+
+
+# Named counters and timers for each phase of a hand. Only one hand out of `sample_every` is timed, the others
+# only pay for a single attribute check in each phase.
+# Phases: deal, putBlinds, runPreFlop, runPostFlop, getAction, incorporateFeedback, showdown.
+# NOTE: runPreFlop and runPostFlop include the getAction and incorporateFeedback calls made during the betting.
+class Profiler:
+    def __init__(self, sample_every=1):
+        self.sample_every = sample_every
+        self.hands = 0
+        self.sampled_hands = 0
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.timers: Dict[str, float] = defaultdict(float)
+
+
+    # Called once at the start of each hand, return whether this hand is timed.
+    def sampleHand(self) -> bool:
+        self.hands += 1
+        if self.hands % self.sample_every:
+            return False
+        self.sampled_hands += 1
+        return True
+
+
+    # Add the time since `start` to the timer `name`, and return the current time to chain the next phase.
+    def lap(self, name: str, start: float) -> float:
+        now = perf_counter()
+        self.timers[name] += now - start
+        self.counters[name] += 1
+        return now
+
+
+    def count(self, name: str, amount=1) -> None:
+        self.counters[name] += amount
+
+
+    # Aggregated stats of each phase. `estimated_seconds` scales the sampled time to all hands.
+    def stats(self) -> Dict[str, Any]:
+        scale = self.hands / self.sampled_hands if self.sampled_hands else 0.0
+        phases = {}
+        for name, seconds in self.timers.items():
+            calls = self.counters[name]
+            phases[name] = {'calls': calls, 'seconds': seconds, 'mean_us': seconds / calls * 1e6 if calls else 0.0,
+                            'estimated_seconds': seconds * scale}
+        counters = {name: value for name, value in self.counters.items() if name not in self.timers}
+        return {'hands': self.hands, 'sampled_hands': self.sampled_hands, 'phases': phases, 'counters': counters}
+
+
+    def report(self) -> str:
+        stats = self.stats()
+        lines = [f"Profiled {stats['sampled_hands']}/{stats['hands']} hands."]
+        for name, phase in sorted(stats['phases'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"{name:<20} {phase['calls']:>10} calls {phase['mean_us']:>10.2f} us/call {phase['estimated_seconds']:>10.3f} s (est.)")
+        for name, value in stats['counters'].items():
+            lines.append(f'{name:<20} {value:>10}')
+        return '\n'.join(lines)
\ No newline at end of file
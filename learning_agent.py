@@ -1,10 +1,13 @@
 import random
 import math
-from collections import defaultdict
-from typing import List, Tuple, Dict, Any, Callable
+from typing import Iterable, List, Tuple, Dict, Any, Callable
 import pickle
 
-from game_state import State, Action
+import numpy as np
+
+from game_state import State, Action, BatchState, kEmptyHistory
+from weight_store import WeightStore, HashedWeights, hashKey
+import checkpoint
 
 
 # Abstract class: an RLAlgorithm performs reinforcement learning.  All it needs
@@ -16,6 +19,11 @@ class LearningAgent:
     # Your algorithm will be asked to produce an action given a state.
     def getAction(self, state: State) -> Action: raise NotImplementedError("Override me")
 
+    # Batched version of getAction() used by `BatchTexasHoldemSimulator`, returns the `Action.value` for each row.
+    # Fixed-policy agents should override it with a vectorized version, the default falls back to getAction().
+    def getActions(self, states: BatchState) -> np.ndarray:
+        return np.array([self.getAction(states.getState(i)).value for i in range(len(states))], dtype=np.int64)
+
     # We will call this function when simulating an MDP, and you should update
     # parameters.
     # If |state| is a terminal state, this function will be called with (s, a,
@@ -25,31 +33,62 @@ class LearningAgent:
     def incorporateFeedback(self, state: State, action: Action, reward: float, newState: State): pass
 
 
+# Legacy pickles keyed the identity features by tuple: (my_id, my_hand, preflop_actions as ((player, action), ...), action).
+# Re-encode them as the int keys of `encodeIdentityFeature()`, otherwise they would never be looked up again.
+def convertLegacyKeys(items: Iterable[Tuple[Any, float]]) -> List[Tuple[int, float]]:
+    from simulator import encodeIdentityFeature  # NOTE: Lazy, the simulator imports this module.
+    converted = []
+    for key, value in items:
+        if isinstance(key, int):
+            converted.append((key, value))
+            continue
+        if not (isinstance(key, tuple) and len(key) == 4 and isinstance(key[3], Action)):
+            raise ValueError(f'Unknown legacy feature key {key!r}')
+        my_id, my_hand, actions, action = key
+        history = kEmptyHistory
+        for player, history_action in actions:
+            history = history.append(player, history_action)
+        converted.append((encodeIdentityFeature(my_id, tuple(my_hand), history.code, action), value))
+    return converted
+
+
 # Performs Q-learning.  Read util.RLAlgorithm for more information.
 # actions: a function that takes a state and returns a list of actions.
 # discount: a number between 0 and 1, which determines the discount factor
 # featureExtractor: a function that takes a state and action and returns a list of (feature name, feature value) pairs.
 # explorationProb: the epsilon value indicating how frequently the policy
 # returns a random action
+# weights_file: a checkpoint (see checkpoint.py) or a legacy pickle of [weights, numIters]. With `read_only` a checkpoint
+# stays memory-mapped, it loads instantly and is shared between processes, but the agent can no longer learn.
 class QLearningAgent(LearningAgent):
-    def __init__(self, actions: Callable, discount: float, featureExtractor: Callable, explorationProb=0.2, weights_file=''):
+    def __init__(self, actions: Callable, discount: float, featureExtractor: Callable, explorationProb=0.2, weights_file='', read_only=False):
         self.actions = actions
         self.discount = discount
         self.featureExtractor = featureExtractor
         self.explorationProb = explorationProb
-        self.weights = defaultdict(float)
+        self.read_only = read_only
+        self.weights = WeightStore()
         self.numIters = 1  # Starting from 1 to avoid divided by zero in `getStepSize()`
         if len(weights_file) > 0:
-            with open(weights_file, 'rb') as file:
-                self.weights, self.numIters = pickle.load(file)
+            if checkpoint.isCheckpoint(weights_file):
+                self.weights, self.numIters = checkpoint.loadCheckpoint(weights_file, read_only)
+            else:
+                with open(weights_file, 'rb') as file:
+                    self.weights, self.numIters = pickle.load(file)
+                if isinstance(self.weights, dict):  # Weights saved before `WeightStore`.
+                    self.weights = WeightStore.fromItems(convertLegacyKeys(self.weights.items()))
+
+
+    def saveWeights(self, path: str) -> None:
+        if self.read_only:
+            raise TypeError('A read_only agent keeps its checkpoint memory-mapped and has nothing new to save')
+        checkpoint.saveCheckpoint(path, self.weights, self.numIters)
 
 
     # Return the Q function associated with the weights and features
     def getQ(self, state: State, action: Action) -> float:
-        score = 0
-        for feature, value in self.featureExtractor(state, action):
-            score += self.weights[feature] * value
-        return score
+        indices, values = self.weights.lookup(self.featureExtractor(state, action))
+        return self.weights.dot(indices, values)
 
 
     # This algorithm will produce an action given a state.
@@ -73,14 +112,100 @@ class QLearningAgent(LearningAgent):
     # You should update the weights using self.getStepSize(); use
     # self.getQ() to compute the current estimate of the parameters.
     def incorporateFeedback(self, state: State, action: Action, reward: float, newState: State) -> None:
+        if self.read_only:
+            return
         eta = self.getStepSize()
-        q_opt = self.getQ(state, action)
+        indices, values = self.weights.intern(self.featureExtractor(state, action))
+        q_opt = self.weights.dot(indices, values)
         v_opt = 0 if newState is None \
                   else max(self.getQ(newState, act) for act in self.actions(newState))
         coefficient = eta * (q_opt - (reward + self.discount * v_opt))
 
-        for feature, value in self.featureExtractor(state, action):
-            self.weights[feature] -= coefficient * value
+        self.weights.update(indices, values, coefficient)
+
+
+
+# Salt of each action for `HashedWeights`, indexed by `Action.value`.
+kActionSalts = np.array([hashKey(('action', value)) for value in range(len(Action) + 1)], dtype=np.uint64)
+
+
+# Q-learning with a hashed linear approximator of 2^bits weights.
+# stateFeatureExtractor: a function that takes a state and returns a list of (feature key, feature value) pairs. The
+# Q value of every action uses the same features salted by the action, so the Q values of all the legal actions are
+# one sparse dot product. The buckets of the last states are cached for every action, so getAction() and the
+# following incorporateFeedback() (which gets the same state objects) extract and hash the features once.
+# weights_file: a file written by saveWeights(), an .npz archive rather than a checkpoint of checkpoint.py.
+# NOTE: It is not a `QLearningAgent`: the weights are a fixed array, not a `WeightStore` of interned features.
+class HashedQLearningAgent(LearningAgent):
+    kCacheSize = 64
+
+    def __init__(self, actions: Callable, discount: float, stateFeatureExtractor: Callable, bits=18, explorationProb=0.2, weights_file='', read_only=False):
+        self.actions = actions
+        self.discount = discount
+        self.stateFeatureExtractor = stateFeatureExtractor
+        self.explorationProb = explorationProb
+        self.read_only = read_only
+        self.weights = HashedWeights(bits)
+        self.numIters = 1
+        self.cache: Dict[int, Tuple[State, np.ndarray, np.ndarray]] = {}  # id(state) -> (state, buckets, values)
+        if len(weights_file) > 0:
+            self.weights, self.numIters = HashedWeights.load(weights_file)
+
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.__dict__, 'cache': {}}
+
+
+    def saveWeights(self, path: str) -> None:
+        if self.read_only:
+            raise TypeError('A read_only agent has nothing new to save')
+        self.weights.save(path, self.numIters)
+
+
+    def getStepSize(self) -> float:
+        return 1.0 / math.sqrt(self.numIters)
+
+
+    # Return the buckets with shape (salts, features), row `action.value` is for `action`, and the feature values.
+    def features(self, state: State) -> Tuple[np.ndarray, np.ndarray]:
+        entry = self.cache.get(id(state))
+        if entry is None or entry[0] is not state:
+            if len(self.cache) >= self.kCacheSize:
+                self.cache.clear()
+            hashes, values = HashedWeights.hashFeatures(self.stateFeatureExtractor(state))
+            entry = self.cache[id(state)] = (state, self.weights.buckets(hashes, kActionSalts), values)
+        return entry[1], entry[2]
+
+
+    # Q value of each action, with one gather and one dot product for all of them.
+    def getQValues(self, state: State, actions: List[Action]) -> np.ndarray:
+        buckets, values = self.features(state)
+        return self.weights.dot(buckets[[action.value for action in actions]], values)
+
+
+    def getQ(self, state: State, action: Action) -> float:
+        return float(self.getQValues(state, [action])[0])
+
+
+    def getAction(self, state: State) -> Action:
+        self.numIters += 1
+        actions = self.actions(state)
+        if random.random() < self.explorationProb:
+            return random.choice(actions)
+        return actions[int(self.getQValues(state, actions).argmax())]
+
+
+    def incorporateFeedback(self, state: State, action: Action, reward: float, newState: State) -> None:
+        if self.read_only:
+            return
+        eta = self.getStepSize()
+        buckets, values = self.features(state)
+        buckets = buckets[action.value]
+        q_opt = float(self.weights.values[buckets] @ values)
+        v_opt = 0 if newState is None else float(self.getQValues(newState, self.actions(newState)).max())
+        coefficient = eta * (q_opt - (reward + self.discount * v_opt))
+
+        self.weights.update(buckets, values, coefficient)
 
 
 
@@ -88,6 +213,9 @@ class StochasticAgent(LearningAgent):
     def getAction(self, state: State) -> Action:
       return random.choice([action for action in Action])
 
+    def getActions(self, states: BatchState) -> np.ndarray:
+        return states.rng.integers(Action.FOLD.value, Action.RAISE.value + 1, len(states))
+
 
 class SingleActionAgent(LearningAgent):
     def __init__(self, action = Action.CALL):
@@ -95,6 +223,9 @@ class SingleActionAgent(LearningAgent):
 
     def getAction(self, state: State) -> Action:
         return self.action
+
+    def getActions(self, states: BatchState) -> np.ndarray:
+        return np.full(len(states), self.action.value, dtype=np.int64)
         
 
 # This agent is only used for the A, K, Q game.
@@ -107,6 +238,13 @@ class AKQAgent(LearningAgent):
         else:
             return random.choice([action for action in Action])
 
+    def getActions(self, states: BatchState) -> np.ndarray:
+        card = states.my_hand[:, 0]
+        actions = states.rng.integers(Action.FOLD.value, Action.RAISE.value + 1, len(states))
+        actions[card == 2] = Action.RAISE.value
+        actions[card == 0] = Action.FOLD.value
+        return actions
+
 
 class HumanAgent(LearningAgent):
     def getAction(self, state: State) -> Action:
@@ -0,0 +1,179 @@
+from statistics import NormalDist
+from typing import Any, Dict, List, Sequence, Tuple
+import math
+
+import numpy as np
+
+from instrumentation import SimulatorHooks
+
+
+# Streaming statistics of a match, with constant memory whatever the number of hands.
+# Win rates are in the unit printed by `TexasHoldemSimulator.run()`: chips won per 100 hands (bb/100).
+
+
+# Running mean and variance with Welford's algorithm.
+class RunningStats:
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0   # Sum of squared differences from the mean.
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    # Merge the stats of another sample (Chan et al.), used for a whole batch of hands at once.
+    def merge(self, count: int, mean: float, m2: float) -> None:
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def stdError(self) -> float:
+        return math.sqrt(self.variance() / self.count) if self.count > 1 else math.inf
+
+
+
+# Running covariance of a result `x` and a control variate `c` whose true mean is known. Subtracting the part of
+# `x` explained by `c` keeps the mean unbiased and removes cov(x, c)^2 / var(c) from the variance.
+class RunningCovariance:
+    __slots__ = ('count', 'mean_x', 'mean_c', 'm2_x', 'm2_c', 'co_moment')
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_c = 0.0
+        self.m2_x = 0.0
+        self.m2_c = 0.0
+        self.co_moment = 0.0
+
+    def update(self, x: float, c: float) -> None:
+        self.count += 1
+        delta_x = x - self.mean_x
+        delta_c = c - self.mean_c
+        self.mean_x += delta_x / self.count
+        self.mean_c += delta_c / self.count
+        self.m2_x += delta_x * (x - self.mean_x)
+        self.m2_c += delta_c * (c - self.mean_c)
+        self.co_moment += delta_x * (c - self.mean_c)
+
+    # Return (mean, variance) of `x` corrected with the optimal coefficient cov(x, c) / var(c).
+    def corrected(self, known_mean_c: float) -> Tuple[float, float]:
+        if self.count < 2:
+            return self.mean_x, 0.0
+        beta = self.co_moment / self.m2_c if self.m2_c > 0 else 0.0
+        variance = (self.m2_x - beta * self.co_moment) / (self.count - 1)
+        return self.mean_x - beta * (self.mean_c - known_mean_c), max(variance, 0.0)
+
+
+
+# Cumulative chips of every player, downsampled to at most `max_points` points. When it is full, every other point
+# is dropped and the spacing between points doubles.
+class ChipHistory:
+    def __init__(self, players: int, max_points=1024):
+        self.max_points = max_points
+        self.spacing = 1
+        self.next_hand = 0
+        self.hands: List[int] = []
+        self.chips: List[Tuple[float, ...]] = []
+        self.record(0, [0.0] * players)
+
+    def record(self, hands: int, chips: Sequence[float]) -> None:
+        if hands < self.next_hand:
+            return
+        self.hands.append(hands)
+        self.chips.append(tuple(chips))
+        self.next_hand = hands + self.spacing
+        if len(self.hands) > self.max_points:
+            self.hands = self.hands[::2]
+            self.chips = self.chips[::2]
+            self.spacing *= 2
+            self.next_hand = self.hands[-1] + self.spacing
+
+
+
+# Per player stats of a match. Feed it the payoffs of every hand (it is also a `SimulatorHooks`), or a whole batch
+# of results from `BatchTexasHoldemSimulator.playHands()`.
+class MatchMetrics(SimulatorHooks):
+    def __init__(self, players: int, confidence=0.95, max_points=1024):
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.hands = 0
+        self.chips = [0.0] * players
+        self.stats = [RunningStats() for _ in range(players)]
+        self.history = ChipHistory(players, max_points)
+
+
+    def update(self, payoffs: Sequence[float]) -> None:
+        self.hands += 1
+        for id, payoff in enumerate(payoffs):
+            self.stats[id].update(payoff)
+            self.chips[id] += payoff
+        self.history.record(self.hands, self.chips)
+
+
+    def onHandEnd(self, simulator, payoffs):
+        self.update(payoffs)
+
+
+    # `results` has shape (hands, players).
+    def updateBatch(self, results: np.ndarray) -> None:
+        means = results.mean(axis=0)
+        m2s = np.square(results - means).sum(axis=0)
+        for id in range(len(self.stats)):
+            self.stats[id].merge(len(results), float(means[id]), float(m2s[id]))
+            self.chips[id] += float(results[:, id].sum())
+        self.hands += len(results)
+        self.history.record(self.hands, self.chips)
+
+
+    def winRate(self, id: int) -> float:
+        return self.stats[id].mean * 100
+
+
+    # Half-width of the confidence interval of the win rate.
+    def halfWidth(self, id: int) -> float:
+        return self.z * self.stats[id].stdError() * 100
+
+
+    def interval(self, id: int) -> Tuple[float, float]:
+        return self.winRate(id) - self.halfWidth(id), self.winRate(id) + self.halfWidth(id)
+
+
+    # Whether every win rate is known within ± `half_width` bb/100.
+    def converged(self, half_width: float, min_hands=1000) -> bool:
+        return self.hands >= min_hands and all(self.halfWidth(id) <= half_width for id in range(len(self.stats)))
+
+
+    def summary(self) -> Dict[str, Any]:
+        return {'hands': self.hands, 'confidence': self.confidence,
+                'agents': [{'win_rate': self.winRate(id), 'half_width': self.halfWidth(id), 'std': math.sqrt(stats.variance())}
+                           for id, stats in enumerate(self.stats)]}
+
+
+    def report(self) -> str:
+        return '\n'.join(f'Agent {id} has win rate: {self.winRate(id): .2f} ± {self.halfWidth(id):.2f} bb/100 '
+                         f'({self.confidence:.0%} CI, {self.hands} hands).' for id in range(len(self.stats)))
+
+
+    # Save the cumulative chips of every player to an image. matplotlib is only needed here, and no window is opened.
+    def exportPlot(self, path: str) -> None:
+        from matplotlib.figure import Figure
+        figure = Figure()
+        axes = figure.subplots()
+        for id in range(len(self.chips)):
+            axes.plot(self.history.hands, [chips[id] for chips in self.history.chips], label=f'Agent {id}')
+        axes.set_title('Cumulative Reward')
+        axes.set_xlabel('Hands')
+        axes.legend()
+        figure.savefig(path)
\ No newline at end of file
@@ -0,0 +1,99 @@
+from typing import Dict, List, Tuple, Any
+import multiprocessing
+import random
+import time
+
+from learning_agent import LearningAgent, QLearningAgent, AKQAgent
+from game_state import getActions
+from simulator import TexasHoldemSimulator, identityFeatureExtractor
+
+
+# Train a copy of the learning agent in a worker process and return what it learned.
+# The learning agent always sits at seat 0, followed by the opponents.
+# Returned tuple: (weight deltas, number of iterations done, number of hands played)
+def trainShard(args: Tuple[QLearningAgent, List[LearningAgent], int, int]) -> Tuple[Dict[Any, float], int, int]:
+    learner, opponents, hands, seed = args
+    random.seed(seed)
+    base_size = len(learner.weights)
+    base_values = learner.weights.values[:]
+    base_iters = learner.numIters
+
+    simulator = TexasHoldemSimulator([learner] + opponents, verbose=0)
+    simulator.dealer_id = seed % len(simulator.agents)
+    for _ in range(hands):
+        simulator.playOneHand()
+
+    # The local copy keeps the indices of the master weights, new features are appended after them.
+    deltas = {}
+    values = learner.weights.values
+    for idx, key in enumerate(learner.weights.keys()):
+        delta = values[idx] - base_values[idx] if idx < base_size else values[idx]
+        if delta != 0.0:
+            deltas[key] = delta
+    return deltas, learner.numIters - base_iters, hands
+
+
+# Self-play training with K simulator workers in a `multiprocessing` pool.
+# Each round the master weights are sent to every worker, each worker plays `sync_every` hands with its own seed,
+# then the weight deltas are merged back into the master:
+# - 'average': the deltas are averaged, like one worker trained on the averaged gradient.
+# - 'sum': the deltas are summed, like the workers trained one after another on the same table.
+# `numIters` of the master always sums the iterations of all the workers so the step size keeps decaying.
+class ParallelTrainer:
+    def __init__(self, learner: QLearningAgent, opponents: List[LearningAgent], workers: int, merge='average', seed=0):
+        assert merge in ('average', 'sum')
+        if not isinstance(learner, QLearningAgent) or learner.read_only:
+            raise TypeError('Only a trainable QLearningAgent can be trained in parallel, its deltas are merged by feature')
+        self.learner = learner
+        self.opponents = opponents
+        self.workers = workers
+        self.merge = merge
+        self.seed = seed
+        self.rounds = 0
+
+
+    def mergeShards(self, shards: List[Tuple[Dict[Any, float], int, int]]) -> None:
+        scale = 1.0 / len(shards) if self.merge == 'average' else 1.0
+        for deltas, iters, _ in shards:
+            for feature, delta in deltas.items():
+                self.learner.weights[feature] += delta * scale
+            self.learner.numIters += iters
+
+
+    # Train for about `hands` hands in total and return the hands per second.
+    def train(self, hands: int, sync_every=1000) -> float:
+        rounds = max(1, hands // (self.workers * sync_every))
+        start = time.perf_counter()
+        played = 0
+        with multiprocessing.Pool(self.workers) as pool:
+            for _ in range(rounds):
+                seeds = [self.seed + self.rounds * self.workers + k for k in range(self.workers)]
+                shards = pool.map(trainShard, [(self.learner, self.opponents, sync_every, seed) for seed in seeds])
+                self.mergeShards(shards)
+                played += sum(shard[2] for shard in shards)
+                self.rounds += 1
+                print(f'{played}/{rounds * self.workers * sync_every} hands.')
+        return played / (time.perf_counter() - start)
+
+
+# Report the hands/sec of the parallel training from 1 to `max_workers` processes.
+def measureScaling(max_workers: int, hands_per_worker=5000, sync_every=1000) -> Dict[int, float]:
+    results = {}
+    for workers in range(1, max_workers + 1):
+        learner = QLearningAgent(getActions, 1.0, identityFeatureExtractor)
+        trainer = ParallelTrainer(learner, [AKQAgent()], workers)
+        results[workers] = trainer.train(hands_per_worker * workers, sync_every)
+    for workers, speed in results.items():
+        print(f'{workers} workers: {speed:.0f} hands/sec, {speed / results[1]:.2f}x')
+    return results
+
+
+def main():
+    learning_agent = QLearningAgent(getActions, 1.0, identityFeatureExtractor, weights_file='')
+    trainer = ParallelTrainer(learning_agent, [AKQAgent()], workers=multiprocessing.cpu_count())
+    speed = trainer.train(100000)
+    print(f'{speed:.0f} hands/sec. Number of features: {len(learning_agent.weights)}')
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,26 +1,49 @@
-from typing import List, Tuple
+from typing import Dict, Iterable, List, NamedTuple
 import random
 
 
-class PokerDeck:
-    def __init__(self):
-        # Standard Deck
-        self.kSuitColor = ['\u001b[37;1m', '\u001b[31m', '\u001b[32;1m', '\u001b[34;1m']
-        self.kSuits = ['♤', '♡', '♧', '♢']
-        self.kRanks = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
+class DeckVariant(NamedTuple):
+    suit_colors: List[str]
+    suits: List[str]
+    ranks: List[str]
+    card_masks: List[int]  # Bit of each card in the standard 52 card layout, see `PokerDeck.standardCard()`.
+
+
+def makeVariant(suit_colors: List[str], suits: List[str], ranks: List[str]) -> DeckVariant:
+    # NOTE: Reduced decks keep the highest ranks, so only the rank needs to be shifted.
+    masks = [1 << (card // len(ranks) * 13 + card % len(ranks) + 13 - len(ranks)) for card in range(len(suits) * len(ranks))]
+    return DeckVariant(suit_colors, suits, ranks, masks)
 
-        # Leduc Deck - AKQ game (Comment out to use the standard deck)
-        self.kSuitColor = ['\u001b[37;1m']
-        self.kSuits = ['♤']
-        self.kRanks = ['Q', 'K', 'A']
 
-        # Leduc Deck - AKQ game (Comment out to use the standard deck)
-        # self.kSuitColor = ['\u001b[37;1m', '\u001b[31m']
-        # self.kSuits = ['♤', '♡']
-        # self.kRanks = ['T', 'J', 'Q', 'K', 'A']
+# The deck variants, built once for the whole process.
+kVariants: Dict[str, DeckVariant] = {
+    # Standard Deck
+    'full': makeVariant(['\u001b[37;1m', '\u001b[31m', '\u001b[32;1m', '\u001b[34;1m'], ['♤', '♡', '♧', '♢'],
+                        ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']),
+    # Leduc Deck
+    'leduc': makeVariant(['\u001b[37;1m', '\u001b[31m'], ['♤', '♡'], ['T', 'J', 'Q', 'K', 'A']),
+    # AKQ game
+    'akq': makeVariant(['\u001b[37;1m'], ['♤'], ['Q', 'K', 'A']),
+}
+kDefaultVariant = 'akq'
 
-        self.deck = list(range(len(self.kSuits) * len(self.kRanks)))
-        random.shuffle(self.deck)
+
+# A card is an int: suit * len(kRanks) + rank. A set of cards can also be a mask with one bit per card in the
+# standard 52 card layout, which `hand_evaluator.evaluateMask()` ranks directly.
+#
+# The deck is dealt with a partial Fisher–Yates shuffle: `self.deck[:self.remaining]` holds the cards not dealt
+# yet in any order, and each deal swaps a random one of them to the end. Only the dealt cards are drawn, and
+# `reset()` returns them without allocating, so one deck is reused for every hand.
+class PokerDeck:
+    def __init__(self, variant=kDefaultVariant):
+        self.variant = variant
+        self.kSuitColor, self.kSuits, self.kRanks, self.kCardMasks = kVariants[variant]
+        self.size = len(self.kSuits) * len(self.kRanks)
+        self.deck = list(range(self.size))
+        self.position = list(range(self.size))  # Index of each card in `self.deck`.
+        self.remaining = self.size
+        self.stacked: List[int] = []  # Cards to deal first, in reversed order. See `stack()`.
+        self.dealt: List[int] = []    # The cards dealt so far, in order. Stacking them replays the deal.
 
 
     # Util function to print a card nicely.
@@ -32,6 +55,72 @@ class PokerDeck:
     def printCards(self, cards: List[int]) -> str:
         return ' '.join([self.printCard(card) for card in cards])
 
-    
+
+    # Convert a card of this deck to the standard 52 card index used by `hand_evaluator`.
+    def standardCard(self, card_index: int) -> int:
+        return self.kCardMasks[card_index].bit_length() - 1
+
+
+    def cardsMask(self, cards: Iterable[int]) -> int:
+        mask = 0
+        for card in cards:
+            mask |= self.kCardMasks[card]
+        return mask
+
+
+    def maskCards(self, mask: int) -> List[int]:
+        return [card for card in range(self.size) if mask & self.kCardMasks[card]]
+
+
+    def dealtMask(self) -> int:
+        return self.cardsMask(self.dealt)
+
+
+    # Put every card back. `dead` cards (e.g. known cards in an equity calculation) are removed from the deck
+    # and will not be dealt.
+    def reset(self, dead: Iterable[int] = ()) -> None:
+        self.remaining = self.size
+        self.stacked.clear()
+        self.dealt.clear()
+        for card in dead:
+            self.removeCard(card)
+
+
+    # Take a card out of the undealt cards.
+    def removeCard(self, card: int) -> None:
+        idx = self.position[card]
+        last = self.remaining - 1
+        if idx > last:
+            raise ValueError(f'{self.printCard(card)} is not in the deck')
+        other = self.deck[last]
+        self.deck[idx], self.deck[last] = other, card
+        self.position[other], self.position[card] = idx, last
+        self.remaining = last
+
+
+    # Preset the deck so that the cards are dealt in the given order. Used to replay a deal.
+    def stack(self, order: List[int]) -> None:
+        self.reset()
+        self.stacked = list(reversed(order))
+
+
     def dealCard(self) -> int:
-        return self.deck.pop()
\ No newline at end of file
+        if self.stacked:
+            card = self.stacked.pop()
+            self.removeCard(card)
+        else:
+            if self.remaining == 0:
+                raise IndexError('deal from an empty deck')
+            idx = int(random.random() * self.remaining)
+            last = self.remaining - 1
+            card = self.deck[idx]
+            other = self.deck[last]
+            self.deck[idx], self.deck[last] = other, card
+            self.position[other], self.position[card] = idx, last
+            self.remaining = last
+        self.dealt.append(card)
+        return card
+
+
+    def dealCards(self, count: int) -> List[int]:
+        return [self.dealCard() for _ in range(count)]
\ No newline at end of file
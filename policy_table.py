@@ -0,0 +1,251 @@
+from array import array
+from typing import List, Sequence, Tuple
+import math
+import random
+import struct
+import sys
+
+from learning_agent import LearningAgent, QLearningAgent
+from game_state import State, PublicState, ExclusiveState, Action, historyFromCode, publicCode, decodePublicCode, kRiver
+from poker_deck import PokerDeck, kDefaultVariant
+from cfr_solver import BettingTree
+from simulator import identityFeatureExtractor, decodeIdentityFeature
+
+
+# Frozen policy compiled from a trained Q learner, for serving bots without the weights.
+#
+# The policy is stored in a perfect hash table (hash and displace): an infoset code goes to a bucket, the
+# displacement of the bucket picks its slot, and the slot holds the (folded) code to reject unknown infosets.
+# A lookup is two multiplications and three array reads, whatever the number of infosets.
+# - Greedy policy: one action value (u8) per slot.
+# - Softmax policy: the cumulative probabilities of FOLD, CALL (f32) per slot, RAISE takes the rest.
+#
+# File: | header | displacements: u32 each | keys: u64 each | policy |, all numbers are little-endian.
+
+kMagic = b'THPOLCY\0'
+kVersion = 1
+kGreedy = 0
+kSoftmax = 1
+kHeader = struct.Struct('<8sIIqq')  # magic, version, mode, size, number of buckets
+kFoldPrime = (1 << 61) - 1           # Infoset codes can be longer than 64 bits, they are folded modulo this prime.
+kMix = 0x9E3779B97F4A7C15
+kMix2 = 0xBF58476D1CE4E5B9
+kMask64 = (1 << 64) - 1
+kEmpty = kMask64
+kActionOf = [None] + list(Action)    # `Action` of each `Action.value`.
+
+
+# The infoset of a player: | publicCode() | my_id: 4 bits | card_1: 6 bits | card_2: 6 bits |
+# i.e. `encodeIdentityFeature()` without the action.
+def encodeInfoset(my_id: int, my_hand: Tuple[int, int], public_code: int) -> int:
+    return ((public_code << 4 | my_id) << 6 | my_hand[0]) << 6 | my_hand[1]
+
+
+# 32-bit hash of a folded key, a different `seed` gives an independent hash.
+def mix(key: int, seed: int) -> int:
+    value = (key ^ seed * kMix) * kMix2 & kMask64
+    return ((value ^ value >> 31) * kMix & kMask64) >> 32
+
+
+class PolicyTable:
+    def __init__(self, mode: int, displacements: array, keys: array, policy: array):
+        self.mode = mode
+        self.displacements = displacements
+        self.keys = keys
+        self.policy = policy
+        self.size = len(keys)
+        self.num_buckets = len(displacements)
+
+
+    # Return the slot of the infoset code, or -1 if it is not in the table.
+    def find(self, code: int) -> int:
+        key = code % kFoldPrime
+        slot = mix(key, self.displacements[mix(key, 0) % self.num_buckets]) % self.size
+        return slot if self.keys[slot] == key else -1
+
+
+    # `policy` has one entry per code: an action value (greedy) or the probabilities of the 3 actions (softmax).
+    @staticmethod
+    def build(codes: Sequence[int], policy: Sequence, mode: int) -> 'PolicyTable':
+        keys = [code % kFoldPrime for code in codes]
+        if len(set(keys)) != len(keys):
+            raise ValueError('Duplicated infoset codes')
+        size = max(1, math.ceil(len(keys) / 0.8))
+        num_buckets = max(1, len(keys) // 4)
+        buckets: List[List[int]] = [[] for _ in range(num_buckets)]
+        for idx, key in enumerate(keys):
+            buckets[mix(key, 0) % num_buckets].append(idx)
+
+        # Place the biggest buckets first, each with the first displacement whose slots are all free.
+        displacements = array('I', [0] * num_buckets)
+        slot_of = [0] * len(keys)
+        occupied = bytearray(size)
+        for bucket in sorted(range(num_buckets), key=lambda bucket: -len(buckets[bucket])):
+            if not buckets[bucket]:
+                break
+            for displacement in range(1, 1 << 32):
+                slots = [mix(keys[idx], displacement) % size for idx in buckets[bucket]]
+                if len(set(slots)) == len(slots) and not any(occupied[slot] for slot in slots):
+                    break
+            displacements[bucket] = displacement
+            for idx, slot in zip(buckets[bucket], slots):
+                occupied[slot] = 1
+                slot_of[idx] = slot
+
+        table_keys = array('Q', [kEmpty] * size)
+        if mode == kGreedy:
+            table_policy = array('B', [0] * size)
+        else:
+            table_policy = array('f', [0.0] * (2 * size))
+        for idx, slot in enumerate(slot_of):
+            table_keys[slot] = keys[idx]
+            if mode == kGreedy:
+                table_policy[slot] = policy[idx]
+            else:
+                table_policy[2 * slot] = policy[idx][0]
+                table_policy[2 * slot + 1] = policy[idx][0] + policy[idx][1]
+        return PolicyTable(mode, displacements, table_keys, table_policy)
+
+
+    def save(self, path: str) -> None:
+        if sys.byteorder != 'little':
+            raise ValueError('Policy tables are only supported on little-endian machines')
+        with open(path, 'wb') as file:
+            file.write(kHeader.pack(kMagic, kVersion, self.mode, self.size, self.num_buckets))
+            file.write(self.displacements.tobytes())
+            file.write(self.keys.tobytes())
+            file.write(self.policy.tobytes())
+
+
+    @staticmethod
+    def load(path: str) -> 'PolicyTable':
+        with open(path, 'rb') as file:
+            magic, version, mode, size, num_buckets = kHeader.unpack(file.read(kHeader.size))
+            if magic != kMagic or version != kVersion:
+                raise ValueError(f'{path} is not a version {kVersion} policy table')
+            displacements = array('I')
+            displacements.frombytes(file.read(4 * num_buckets))
+            keys = array('Q')
+            keys.frombytes(file.read(8 * size))
+            policy = array('B' if mode == kGreedy else 'f')
+            policy.frombytes(file.read())
+        return PolicyTable(mode, displacements, keys, policy)
+
+
+    def nbytes(self) -> int:
+        return sum(len(part) * part.itemsize for part in (self.displacements, self.keys, self.policy))
+
+
+
+# Public state of the decision of a `publicCode()`, replaying the bets of every street as the simulator does with
+# unlimited stacks: the blinds, then CALL pays the call cost and RAISE also pays half of the pot, see
+# `State.getRaiseCost()`.
+def publicFromCode(code: int, players: int) -> PublicState:
+    public = PublicState(players)
+    public.street, histories, public.cards = decodePublicCode(code)
+    public.preflop_actions, public.flop_actions, public.turn_actions, public.river_actions = histories
+    for idx, (id, action) in enumerate(action for history in histories for action in history):
+        call_cost = public.current_bet - public.players_bet[id]
+        if idx < 2:
+            amount = idx + 1  # Small blind, big blind
+        elif action == Action.RAISE:
+            amount = call_cost + round((public.pot + call_cost) * 0.5)
+        else:
+            amount = call_cost if action == Action.CALL else 0
+        public.pot += amount
+        public.players_bet[id] += amount
+        public.current_bet = max(public.current_bet, public.players_bet[id])
+    return public
+
+
+# The infosets the agent has weights for: (my_id, my_hand, public state) of its identity features, whatever the
+# number of players, cards and streets it was trained with.
+def learnedInfosets(agent: QLearningAgent) -> List[Tuple[int, Tuple[int, int], PublicState]]:
+    infosets = dict.fromkeys(decodeIdentityFeature(key)[:3] for key in agent.weights.keys())
+    publics = {code: decodePublicCode(code)[1] for code in dict.fromkeys(code for _, _, code in infosets)}
+    players = 1 + max([my_id for my_id, _, _ in infosets]
+                      + [id for histories in publics.values() for history in histories for id, _ in history], default=1)
+    return [(my_id, my_hand, publicFromCode(code, players)) for my_id, my_hand, code in infosets]
+
+
+# Every infoset of the heads-up one card game with at most `max_raises` raises, see `cfr_solver.BettingTree`.
+def treeInfosets(variant: str, max_raises: int) -> List[Tuple[int, Tuple[int, int], PublicState]]:
+    deck = PokerDeck(variant)
+    tree = BettingTree(max_raises)
+    infosets = []
+    for node, actor in enumerate(tree.actor):
+        if actor < 0:
+            continue
+        public = PublicState(len(tree.players_bet[node]))
+        public.preflop_actions = historyFromCode(tree.history[node])
+        public.players_bet = list(tree.players_bet[node])
+        public.pot = sum(public.players_bet)
+        public.current_bet = max(public.players_bet)
+        infosets.extend((actor, (card, card), public) for card in range(deck.size))
+    return infosets
+
+
+# Evaluate the Q values of `agent` at every infoset and keep the greedy action, or the softmax policy if
+# `temperature` > 0.
+# - An agent with `identityFeatureExtractor` is compiled at the infosets of its own features, so any table it was
+#   trained at is covered. If that is the heads-up one card game, the unseen infosets of the betting tree are added.
+# - Other feature extractors can't be decoded, the infosets are then enumerated from the heads-up betting tree, which
+#   only covers the heads-up one card game: `players` and `streets` (the game the agent was trained in) must be 2
+#   and 1.
+def compilePolicy(agent: QLearningAgent, variant=kDefaultVariant, max_raises=6, temperature=0.0, players=2, streets=1) -> PolicyTable:
+    if getattr(agent, 'featureExtractor', None) is identityFeatureExtractor:
+        infosets = learnedInfosets(agent)
+        players = infosets[0][2].players if infosets else players
+        if any(hand[0] != hand[1] for _, hand, _ in infosets):
+            streets = kRiver + 1  # Two card hands.
+    elif players != 2 or streets != 1:
+        raise ValueError(f'Only the heads-up one card game can be enumerated for {type(agent).__name__} without identity features')
+    else:
+        infosets = []
+    if players == 2 and streets == 1:
+        infosets += treeInfosets(variant, max_raises)
+
+    codes = []
+    policy = []
+    compiled = set()
+    for actor, hand, public in infosets:
+        code = encodeInfoset(actor, hand, publicCode(public))
+        if code in compiled:
+            continue
+        compiled.add(code)
+        state = State(ExclusiveState(actor, hand), public)
+        actions = agent.actions(state)
+        q_values = [agent.getQ(state, action) for action in actions]
+        codes.append(code)
+        if temperature <= 0:
+            policy.append(max(zip(q_values, actions), key=lambda tup: tup[0])[1].value)
+        else:
+            best = max(q_values)
+            weights = [math.exp((q - best) / temperature) for q in q_values]
+            probs = [0.0] * len(Action)
+            for action, weight in zip(actions, weights):
+                probs[action.value - 1] = weight / sum(weights)
+            policy.append(probs)
+    return PolicyTable.build(codes, policy, kGreedy if temperature <= 0 else kSoftmax)
+
+
+
+# Serve a `PolicyTable`. getAction() only does a table lookup, and calls at an infoset outside of the table.
+class FrozenPolicyAgent(LearningAgent):
+    def __init__(self, table: PolicyTable):
+        self.table = table
+        self.find = table.find
+        self.policy = table.policy
+        self.greedy = table.mode == kGreedy
+
+    def getAction(self, state: State) -> Action:
+        exclusive = state.exclusive
+        slot = self.find(((publicCode(state.public) << 4 | exclusive.my_id) << 6 | exclusive.my_hand[0]) << 6 | exclusive.my_hand[1])
+        if slot < 0:
+            return Action.CALL
+        if self.greedy:
+            return kActionOf[self.policy[slot]]
+        sample = random.random()
+        if sample < self.policy[2 * slot]:
+            return Action.FOLD
+        return Action.CALL if sample < self.policy[2 * slot + 1] else Action.RAISE
\ No newline at end of file
@@ -1,26 +1,94 @@
-from copy import copy, deepcopy
-from typing import List, Tuple, Any
-import queue
-import matplotlib.pyplot as plt
-import pickle
+from time import perf_counter
+from typing import Generator, List, Tuple, Optional, Union
 import random
 
-from learning_agent import LearningAgent, SingleActionAgent, StochasticAgent, AKQAgent, QLearningAgent, HumanAgent  # type: ignore
+from learning_agent import LearningAgent, SingleActionAgent, StochasticAgent, AKQAgent, QLearningAgent, HashedQLearningAgent, HumanAgent  # type: ignore
 from game_state import *
-from poker_deck import PokerDeck
+from poker_deck import PokerDeck, kDefaultVariant
+from instrumentation import SimulatorHooks, VerboseHooks, Profiler
+from metrics import MatchMetrics, RunningCovariance
+import hand_evaluator
 
 
+# The players who can still act in a betting round, in order of talk. A player is taken from the front and put back
+# at the end unless they fold or go all-in, so a preallocated buffer with one slot per seat is enough.
+class SeatRing:
+    __slots__ = ('seats', 'head', 'count')
+
+    def __init__(self, size: int):
+        self.seats = [0] * size
+        self.head = 0
+        self.count = 0
+
+    def clear(self) -> None:
+        self.head = 0
+        self.count = 0
+
+    def push(self, id: int) -> None:
+        self.seats[(self.head + self.count) % len(self.seats)] = id
+        self.count += 1
+
+    def pop(self) -> int:
+        id = self.seats[self.head]
+        self.head = (self.head + 1) % len(self.seats)
+        self.count -= 1
+        return id
+
+    def front(self) -> int:
+        return self.seats[self.head]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+
+# hooks: `SimulatorHooks` called during each hand, `verbose = 2` adds the printing hooks.
+# profiler: optional `Profiler` timing each phase of the sampled hands.
+# deck_variant: 'akq', 'leduc' or 'full', see `poker_deck.kVariants`. One deck is reset and reused for every hand.
+# streets: 1 plays the simplified pre-flop only game (one card per player, see `winningHand()`). 2~4 deal two cards
+#     to each player and also play the flop, turn and river.
+# stack: chips of each player at the start of every hand, or a list with the stack of each seat. 0 is unlimited.
+#     A player who can't pay goes all-in, and the pot is split in side pots (see `splitPot()`).
 class TexasHoldemSimulator:
-    def __init__(self, agent_list: List[LearningAgent], verbose = 2):
+    def __init__(self, agent_list: List[LearningAgent], verbose = 2, hooks: Optional[List[SimulatorHooks]] = None, profiler: Optional[Profiler] = None, deck_variant=kDefaultVariant,
+                 streets=1, stack: Union[int, List[int]] = 0):
+        if len(agent_list) > kMaxPlayers:
+            raise ValueError(f'At most {kMaxPlayers} players, the action history encodes the player ids in 4 bits')
         self.agents = agent_list
         self.chips = [0.0] * len(self.agents)
         self.dealer_id = 0   # Indicate who should talk first. small_blind = dealer + 1, big_blind = dealer + 2
         self.verbose = verbose
-
-
-    # TODO: Implement a complete version for Texas Hold'em.
+        self.hooks = list(hooks) if hooks else []
+        if verbose == 2:
+            self.hooks.append(VerboseHooks())
+        self.profiler = profiler
+        self.timed = False   # Whether the current hand is sampled by the profiler.
+        self.deck = PokerDeck(deck_variant)
+        if not 1 <= streets <= len(kStreetNames):
+            raise ValueError(f'streets must be in 1~{len(kStreetNames)}')
+        if len(self.agents) * (1 if streets == 1 else 2) + sum(kStreetCards[:streets]) > self.deck.size:
+            raise ValueError(f'The {deck_variant} deck is too small for {len(self.agents)} players and {streets} streets')
+        self.stacks = [stack] * len(self.agents) if isinstance(stack, int) else list(stack)
+        if len(self.stacks) != len(self.agents) or any(0 < stack <= 2 for stack in self.stacks):
+            raise ValueError('Each stack must be bigger than the big blind')
+        self.streets = streets
+        self.seats = SeatRing(len(self.agents))
+        self.folded = [False] * len(self.agents)  # Flags of the current hand.
+        self.all_in = [False] * len(self.agents)
+        self.live = len(self.agents)              # Players not folded in the current hand.
+
+
+    # Return the index of the best hands. With enough public cards the hands are ranked by `hand_evaluator`,
+    # otherwise (pre-flop only game) the comparision reduce to `pair > high_card`.
     def winningHand(self, hands: List[Tuple[int, int]], public_cards: tuple, deck: PokerDeck):
         rank = []
+        if len(public_cards) + 2 >= 5:
+            board = [deck.standardCard(card) for card in public_cards]
+            for card_1, card_2 in hands:
+                rank.append(hand_evaluator.evaluate([deck.standardCard(card_1), deck.standardCard(card_2)] + board))
+            max_rank = max(rank)
+            return [idx for idx, value in enumerate(rank) if value == max_rank]
+
         for card_1, card_2 in hands:
             num_1 = card_1 % len(deck.kRanks) + 1  # +1 to avoid 0 value.
             num_2 = card_2 % len(deck.kRanks) + 1
@@ -46,6 +114,33 @@ class TexasHoldemSimulator:
         return [active_id[winner] for winner in self.winningHand(active_hand, public_state.cards, deck)]
 
 
+    # Return the chips won by each player and the winners of the main pot. With finite stacks an all-in player can
+    # only win from each other player up to its own bet: the pot is cut into layers at the bet of each player still
+    # in the hand, and every layer goes to the best hands among the players who paid for it.
+    def splitPot(self, exclusive_states: List[ExclusiveState], public_state: PublicState, deck: PokerDeck) -> Tuple[List[float], List[int]]:
+        bets = public_state.players_bet
+        contenders = [id for id in range(len(self.agents)) if not self.folded[id]]
+        rewards = [0.0] * len(self.agents)
+        levels = sorted({bets[id] for id in contenders})
+        if len(levels) == 1:  # No side pot, always the case with unlimited stacks.
+            winners = self.showdown(exclusive_states, public_state, contenders, deck)
+            for id in winners:
+                rewards[id] = public_state.pot / len(winners)
+            return rewards, winners
+
+        previous = 0
+        main_winners = []
+        for idx, level in enumerate(levels):
+            top = level if idx + 1 < len(levels) else max(bets)  # Folded bets above every contender go to the last layer.
+            layer = sum(min(bet, top) - min(bet, previous) for bet in bets)
+            winners = self.showdown(exclusive_states, public_state, [id for id in contenders if bets[id] >= level], deck)
+            for id in winners:
+                rewards[id] += layer / len(winners)
+            main_winners = main_winners or winners
+            previous = level
+        return rewards, main_winners
+
+
     # A transaction deduct chips from player and add to the pot.
     # NOTE: The positive amount is flow into the pot.
     def updateChips(self, public_state, exclusive_states, player_id, amount):
@@ -60,136 +155,331 @@ class TexasHoldemSimulator:
         big_blind_id = (self.dealer_id + 2) % len(self.agents)
         
         # Small blind and Big blind putting their chips.
-        public_state.preflop_actions = public_state.preflop_actions + ((small_blind_id, Action.RAISE),)  # Raise from 0 to 1
+        public_state.preflop_actions = public_state.preflop_actions.append(small_blind_id, Action.RAISE)  # Raise from 0 to 1
         self.updateChips(public_state, exclusive_states, small_blind_id, 1)
-        if self.verbose == 2:
-            print(f'Pot: {1}\t', end='')
-            State(exclusive_states[small_blind_id], public_state).print(deck)
+        for hook in self.hooks:
+            hook.onAction(self, deck, public_state, exclusive_states[small_blind_id], Action.RAISE)
         
-        public_state.preflop_actions = public_state.preflop_actions + ((big_blind_id, Action.RAISE),)  # Raise from 1 to 2
+        public_state.preflop_actions = public_state.preflop_actions.append(big_blind_id, Action.RAISE)  # Raise from 1 to 2
         self.updateChips(public_state, exclusive_states, big_blind_id, 2)
-        if self.verbose == 2:
-            print(f'Pot: {3}\t', end='')
-            State(exclusive_states[big_blind_id], public_state).print(deck)
+        for hook in self.hooks:
+            hook.onAction(self, deck, public_state, exclusive_states[big_blind_id], Action.RAISE)
 
         public_state.current_bet = 2
 
 
     # TODO: remove `deck` argument from here.
-    def runPreFlop(self, deck: PokerDeck, public_state: PublicState, exclusive_states: List[ExclusiveState], active_players: queue.Queue):
-        # Initilize players
+    # One betting round of the current street, the first player to talk is `first_id` or the next one still able to
+    # act. The round is over when everyone able to act has talked since the last raise, or when one player is left.
+    # An action only updates the pot, the current bet and the bet of the player, so it costs O(1) however long the
+    # history is. Generator, see `handSteps()`.
+    def runStreet(self, deck: PokerDeck, public_state: PublicState, exclusive_states: List[ExclusiveState], privious: list, first_id: int):
         total_players = len(self.agents)
-        stop_id = id = (self.dealer_id + 3) % total_players
-        privious = [None] * total_players  # Store the previous state / action / reward for updating incorporateFeedback().
-
-        while active_players.qsize() > 1:
-            id = active_players.get()
-            state = deepcopy(State(exclusive_states[id], public_state))
-
-            if privious[id] != None:  # Avoid the first call by checking Action
-                self.agents[id].incorporateFeedback(privious[id][0], privious[id][1], privious[id][2], state)
-                
-            action = self.agents[id].getAction(state)
-            call_cost = state.getCallCost()
-            raise_cost = state.getRaiseCost()
+        folded = self.folded
+        all_in = self.all_in
+        seats = self.seats
+        seats.clear()
+        for offset in range(total_players):
+            id = (first_id + offset) % total_players
+            if not folded[id] and not all_in[id]:
+                seats.push(id)
+        if len(seats) == 1 and public_state.players_bet[seats.front()] == public_state.current_bet:
+            return  # Nobody left to bet against, the others are all-in.
+
+        to_act = len(seats)  # Number of players who still have to talk in this round.
+        while to_act > 0 and self.live > 1:
+            id = seats.pop()
+            to_act -= 1
+            exclusive_state = exclusive_states[id]
+            state = State(exclusive_state, public_state).snapshot()
+
+            if self.timed:
+                start = perf_counter()
+                if privious[id] != None:
+                    self.agents[id].incorporateFeedback(privious[id][0], privious[id][1], privious[id][2], state)
+                    start = self.profiler.lap('incorporateFeedback', start)
+                action = yield id, state
+                self.profiler.lap('getAction', start)
+            else:
+                if privious[id] != None:  # Avoid the first call by checking Action
+                    self.agents[id].incorporateFeedback(privious[id][0], privious[id][1], privious[id][2], state)
+                action = yield id, state
 
             if action == Action.FOLD:
                 privious[id] = (state, action, 0)
-            elif action == Action.RAISE:
-                stop_id = id  # The raise will refresh stop_id of the last player who eligible to talk.
-                privious[id] = (state, action, -call_cost - raise_cost)
-                self.updateChips(public_state, exclusive_states, id, call_cost + raise_cost)  # NOTE: Here player must CALL to match the previous player then RAISE.
-                active_players.put(id)
-                public_state.current_bet += raise_cost
-            else:  # Action.CALL
-                privious[id] = (state, action, -call_cost)
-                self.updateChips(public_state, exclusive_states, id, call_cost)
-                active_players.put(id)
+                folded[id] = True
+                self.live -= 1
+            else:
+                # NOTE: Here player must CALL to match the previous player then RAISE.
+                amount = state.getCallCost() + state.getRaiseCost() if action == Action.RAISE else state.getCallCost()
+                if self.stacks[id] and amount >= exclusive_state.chips:
+                    amount = exclusive_state.chips  # All-in, the player won't talk again in this hand.
+                    all_in[id] = True
+                else:
+                    seats.push(id)
+                privious[id] = (state, action, -amount)
+                self.updateChips(public_state, exclusive_states, id, amount)
+                if public_state.players_bet[id] > public_state.current_bet:
+                    public_state.current_bet = public_state.players_bet[id]
+                    to_act = len(seats) - (not all_in[id])  # A raise lets everyone else talk again.
 
             # Update public state.
-            public_state.preflop_actions = public_state.preflop_actions + ((id, action),)
-
-            # Print Info
-            if self.verbose == 2:
-                print(f'Pot: {public_state.pot}\t', end='') 
-                State(exclusive_states[id], public_state).print(deck)
-
-            id = (id + 1) % total_players
-            if id == stop_id:
-                break  # Preflp talk completed with no one raise in previous round.
-        
-        return privious
-
-
-    def playOneHand(self) -> None:
+            public_state.appendAction(id, action)
+
+            for hook in self.hooks:
+                hook.onAction(self, deck, public_state, exclusive_state, action)
+
+
+    # `deck` can be given to replay a stacked deck, see `PokerDeck.stack()`. Return the chip change of each player.
+    def playOneHand(self, deck: Optional[PokerDeck] = None) -> List[float]:
+        agents = self.agents
+        steps = self.handSteps(deck)
+        send = steps.send
+        try:
+            id, state = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        while True:
+            action = agents[id].getAction(state)  # NOTE: Outside of the try, a StopIteration of an agent must propagate.
+            try:
+                id, state = send(action)
+            except StopIteration as stop:
+                return stop.value
+
+
+    # Play one hand as a generator: it yields (player_id, state) whenever a player has to act and expects the action
+    # to be sent back, and returns the chip change of each player. This lets a caller get the actions from
+    # elsewhere, e.g. the asyncio `table_server`. Everything else (feedback, hooks) is done here.
+    def handSteps(self, deck: Optional[PokerDeck] = None) -> Generator[Tuple[int, State], Action, List[float]]:
         # Deal the card to players. Initlize the start state for each agent.
         # NOTE: The order of dealing the card is not as real game. It shouldn't matter because the deck is shuffled.
-        deck = PokerDeck() # Prepare the deck and shuffle it.
-        public_state = PublicState(len(self.agents))   # Only need one because it's shared information.
-        exclusive_states = []                          # This will be different for each player.
-        active_players = queue.Queue()
-        for id in range(len(self.agents)):
-            # NOTE: One simplfy is limited to only AA, KK, QQ
-            card = deck.dealCard()
-            exclusive_states.append(ExclusiveState(id, (card, card)))
-            # exclusive_states.append(ExclusiveState(id, (deck.dealCard(), deck.dealCard())))
-            active_players.put((self.dealer_id + 3 + id) % len(self.agents))
-            if self.verbose == 2:
-                print(f'Player_{id}:', deck.printCards(exclusive_states[-1].my_hand))
-
+        self.timed = self.profiler is not None and self.profiler.sampleHand()
+        if self.timed:
+            start = perf_counter()
+        if deck is None:
+            deck = self.deck
+            deck.reset()  # The cards are shuffled as they are dealt.
+        total_players = len(self.agents)
+        public_state = PublicState(total_players)   # Only need one because it's shared information.
+        exclusive_states = []                       # This will be different for each player.
+        for id in range(total_players):
+            if self.streets == 1:
+                # NOTE: One simplfy is limited to only AA, KK, QQ
+                card = deck.dealCard()
+                exclusive_states.append(ExclusiveState(id, (card, card), self.stacks[id]))
+            else:
+                exclusive_states.append(ExclusiveState(id, (deck.dealCard(), deck.dealCard()), self.stacks[id]))
+        self.folded = [False] * total_players
+        self.all_in = [False] * total_players
+        self.live = total_players  # Players not folded.
+        privious = [None] * total_players  # Store the previous state / action / reward for updating incorporateFeedback().
+        if self.timed:
+            start = self.profiler.lap('deal', start)
+        for hook in self.hooks:
+            hook.onDeal(self, deck, exclusive_states)
 
         self.putBlinds(deck, public_state, exclusive_states)
-        privious = self.runPreFlop(deck, public_state, exclusive_states, active_players)
-        # TODO: rotate the active_players queue to let small_blind act first.
-        # TODO: run Flop
-        # TODO: rotate the active_players queue to let small_blind act first.
-        # TODO: run Turn
-        # TODO: rotate the active_players queue to let small_blind act first.
-        # TODO: run River
+        if self.timed:
+            start = self.profiler.lap('putBlinds', start)
+        yield from self.runStreet(deck, public_state, exclusive_states, privious, (self.dealer_id + 3) % total_players)
+        if self.timed:
+            start = self.profiler.lap('runPreFlop', start)
+
+        # After the pre-flop, the small blind talks first.
+        if self.streets > 1:
+            for street in range(kFlop, self.streets):
+                if self.live <= 1:
+                    break
+                public_state.street = street
+                public_state.cards += tuple(deck.dealCards(kStreetCards[street]))
+                for hook in self.hooks:
+                    hook.onStreet(self, deck, public_state)
+                yield from self.runStreet(deck, public_state, exclusive_states, privious, (self.dealer_id + 1) % total_players)
+            if self.timed:
+                start = self.profiler.lap('runPostFlop', start)
 
         # Calculate winner
-        winners = self.showdown(exclusive_states, public_state, list(active_players.queue), deck)
-        if self.verbose == 2:
-            print(f'The winners are player {winners}')
+        rewards, winners = self.splitPot(exclusive_states, public_state, deck)
+        if self.timed:
+            start = self.profiler.lap('showdown', start)
+        for hook in self.hooks:
+            hook.onShowdown(self, winners)
         # One more update for the final reward
-        for id in range(len(self.agents)):
-            reward = public_state.pot / len(winners) if id in winners else 0
+        payoffs = [0.0] * total_players
+        for id in range(total_players):
+            reward = rewards[id]
             if privious[id] != None:  # Some player may not doen a single action for the whole hand so the `previous` will be None.
                 self.agents[id].incorporateFeedback(privious[id][0], privious[id][1], privious[id][2] + reward, None)
+                if self.timed:
+                    start = self.profiler.lap('incorporateFeedback', start)
+            payoffs[id] = reward - public_state.players_bet[id]
             self.updateChips(public_state, exclusive_states, id, -reward)
-            
-        
-        if self.verbose == 2:
-            print(f"Players' chips: {self.chips}\n")
-
-        # Shift dealer position for next hand.
-        self.dealer_id = (self.dealer_id + 1) % len(self.agents)
 
+        for hook in self.hooks:
+            hook.onHandEnd(self, payoffs)
 
-    def run(self, hands: int):
-        history = []  # Store the chip history of agent_0 after each hand.
+        # Shift dealer position for next hand.
+        self.dealer_id = (self.dealer_id + 1) % total_players
+        return payoffs
+
+
+    def saveCheckpoints(self, prefix: str) -> None:
+        for id, agent in enumerate(self.agents):
+            if isinstance(agent, QLearningAgent) and not agent.read_only:  # A read_only agent doesn't learn.
+                agent.saveWeights(f'{prefix}_agent{id}.ckpt')
+            elif isinstance(agent, HashedQLearningAgent) and not agent.read_only:
+                agent.saveWeights(f'{prefix}_agent{id}.npz')
+
+
+    # With `checkpoint_every` > 0, the weights of each `QLearningAgent` are saved every `checkpoint_every` hands
+    # to `{checkpoint_prefix}_agent{id}.ckpt` (`.npz` for a `HashedQLearningAgent`), so a crash in a long run loses
+    # at most that many hands.
+    # With `ci_half_width` > 0, the run stops early once the `confidence` interval of every agent's win rate is
+    # within ± `ci_half_width` bb/100. It is checked every 1000 hands, after at least `min_hands` hands.
+    # With `control_variate`, the win rates are also corrected by the showdown equity of the dealt cards (share of the
+    # pot `winningHand()` gives them with the whole board), whose mean 1 / players is known. The cards of each hand
+    # are drawn up front for it, including a board that may not be dealt.
+    # `plot_file` saves the cumulative chips of every agent to an image (see `MatchMetrics.exportPlot()`).
+    # Return the aggregated stats of the run, including the profiler stats if any.
+    def run(self, hands: int, checkpoint_every=0, checkpoint_prefix='checkpoint', ci_half_width=0.0, min_hands=1000, confidence=0.95, plot_file='',
+            control_variate=False):
+        total_players = len(self.agents)
+        metrics = MatchMetrics(total_players, confidence)
+        covariances = [RunningCovariance() for _ in range(total_players)]
+        hole = 1 if self.streets == 1 else 2
         for i in range(hands):
-            self.playOneHand()
-            history.append(deepcopy(self.chips[0]))
+            if control_variate:
+                cards = random.sample(range(self.deck.size), total_players * hole + sum(kStreetCards[:self.streets]))
+                self.deck.stack(cards)
+                payoffs = self.playOneHand(self.deck)
+                shares = self.showdownShares(cards)
+                for id in range(total_players):
+                    covariances[id].update(payoffs[id], shares[id])
+            else:
+                payoffs = self.playOneHand()
+            metrics.update(payoffs)
             if i % 1000 == 0:
                 print(f'{i}/{hands} hands.')
-
-        for id in range(len(self.agents)):
-            print(f'Agent {id} has win rate: {self.chips[id] / hands * 100: .2f} bb/100.')
-
-        plt.plot(history)
-        plt.title("Cumulative Reward")
-        plt.show()
+            if checkpoint_every > 0 and (i + 1) % checkpoint_every == 0:
+                self.saveCheckpoints(checkpoint_prefix)
+            if ci_half_width > 0 and (i + 1) % 1000 == 0 and metrics.converged(ci_half_width, min_hands):
+                print(f'Converged to ± {ci_half_width} bb/100 after {i + 1} hands.')
+                break
+
+        print(metrics.report())
+        if plot_file:
+            metrics.exportPlot(plot_file)
+
+        stats = {'hands': metrics.hands, 'chips': list(self.chips), 'metrics': metrics.summary()}
+        if control_variate:
+            stats['control_variate'] = []
+            for id in range(total_players):
+                mean, variance = covariances[id].corrected(1 / total_players)
+                half_width = metrics.z * (variance / metrics.hands) ** 0.5 * 100
+                reduction = metrics.stats[id].variance() / variance if variance > 0 else float('inf')
+                stats['control_variate'].append({'win_rate': mean * 100, 'half_width': half_width, 'variance_reduction': reduction})
+                print(f'Agent {id} has control variate win rate: {mean * 100: .2f} ± {half_width:.2f} bb/100, variance reduction x{reduction:.2f}.')
+        if self.profiler is not None:
+            stats['profile'] = self.profiler.stats()
+        return stats
+
+
+    # Share of the pot each player would get at a showdown of the stacked `cards` (hole cards of each player in
+    # dealing order, then the whole board) if nobody folded.
+    def showdownShares(self, cards: List[int]) -> List[float]:
+        total_players = len(self.agents)
+        if self.streets == 1:
+            hands = [(card, card) for card in cards[:total_players]]
+        else:
+            hands = [(cards[2 * id], cards[2 * id + 1]) for id in range(total_players)]
+        winners = self.winningHand(hands, tuple(cards[len(hands) * (1 if self.streets == 1 else 2):]), self.deck)
+        return [1 / len(winners) if id in winners else 0.0 for id in range(total_players)]
+
+
+    # Duplicate evaluation: each seeded deal is played once per agent, with the dealer button moved by one seat each
+    # time while the cards stay with their position, so every agent plays every position with the same cards and
+    # the card luck cancels out. The result of a deal is the mean over its rotations.
+    # NOTE: No control variate here (see `run()`): over the rotations of a deal every agent holds each position's
+    # cards once, so the mean showdown equity is exactly 1 / players and the correction would always be 0.
+    # The early stop works as in `run()`, on the duplicate results. Return the duplicate and plain stats, and for each
+    # agent the variance reduction, i.e. how many times fewer hands are needed for the same confidence interval.
+    def runDuplicate(self, deals: int, seed=0, ci_half_width=0.0, min_hands=1000, confidence=0.95):
+        total_players = len(self.agents)
+        rng = random.Random(seed)
+        duplicate = MatchMetrics(total_players, confidence)
+        plain = MatchMetrics(total_players, confidence)
+        hole = 1 if self.streets == 1 else 2
+        for deal in range(deals):
+            # Hole cards of each position from the dealer, then the public cards.
+            cards = rng.sample(range(self.deck.size), total_players * hole + sum(kStreetCards[:self.streets]))
+            board = cards[total_players * hole:]
+            button = self.dealer_id
+            deal_payoffs = [0.0] * total_players
+            for rotation in range(total_players):
+                self.dealer_id = (button + rotation) % total_players
+                hands = [tuple(cards[(id - self.dealer_id) % total_players * hole:][:hole]) for id in range(total_players)]
+                self.deck.stack([card for hand in hands for card in hand] + board)
+                payoffs = self.playOneHand(self.deck)
+                plain.update(payoffs)
+                for id in range(total_players):
+                    deal_payoffs[id] += payoffs[id] / total_players
+            self.dealer_id = (button + 1) % total_players
+            duplicate.update(deal_payoffs)
+            if ci_half_width > 0 and plain.hands % 1000 < total_players and duplicate.converged(ci_half_width, min_hands // total_players):
+                print(f'Converged to ± {ci_half_width} bb/100 after {deal + 1} deals.')
+                break
+
+        stats = {'deals': duplicate.hands, 'hands': plain.hands, 'duplicate': duplicate.summary(), 'plain': plain.summary(),
+                 'variance_reduction': [plain.stats[id].variance() / (total_players * duplicate.stats[id].variance())
+                                        if duplicate.stats[id].variance() > 0 else float('inf') for id in range(total_players)]}
+        print(f'Duplicate ({duplicate.hands} deals x {total_players} seats):')
+        print(duplicate.report())
+        print(f'Plain ({plain.hands} hands):')
+        print(plain.report())
+        for id, reduction in enumerate(stats['variance_reduction']):
+            print(f'Agent {id} duplicate variance reduction: x{reduction:.2f}.')
+        return stats
+
+
+# Pack the identity feature (my_id, my_hand, public information, action) into a single int:
+# | publicCode() | my_id: 4 bits | card_1: 6 bits | card_2: 6 bits | action: 2 bits |
+# The public code holds the street, the actions of every street and the board (see `publicCode()`), so the same hand
+# gets a different feature on each street. Before the flop it is the code of `preflop_actions`.
+def encodeIdentityFeature(my_id: int, my_hand: Tuple[int, int], public_code: int, action: Action) -> int:
+    return (((public_code << 4 | my_id) << 6 | my_hand[0]) << 6 | my_hand[1]) << 2 | action.value
+
+
+# Return (my_id, my_hand, public code, action), see `decodePublicCode()` for the public code.
+def decodeIdentityFeature(key: int) -> Tuple[int, Tuple[int, int], int, Action]:
+    return (key >> 14) & 0xF, ((key >> 8) & 0x3F, (key >> 2) & 0x3F), key >> 18, Action(key & 3)
 
 
 # Return a single-element list containing a binary (indicator) feature
 # for the existence of the (state, action) pair.  Provides no generalization.
-def identityFeatureExtractor(state: State, action: Action) -> List[Tuple[Tuple[Any, Action], float]]:
-    # NOTE: Do not directly put the State object into the tuple since it will use the object ID as hash key.
+def identityFeatureExtractor(state: State, action: Action) -> List[Tuple[int, float]]:
+    # NOTE: The key is a compact int (see `encodeIdentityFeature()`) so `WeightStore` can intern it cheaply.
     # TODO: Not all attribute is extracted from state. Build a better feature extractor.
-    featureKey = (state.exclusive.my_id, state.exclusive.my_hand, state.public.preflop_actions, action)
+    featureKey = encodeIdentityFeature(state.exclusive.my_id, state.exclusive.my_hand, publicCode(state.public), action)
     featureValue = 1
-    return [(featureKey, featureValue)]  # type: ignore
+    return [(featureKey, featureValue)]
+
+
+# State features for `HashedQLearningAgent`, the action is added by the agent. The low 2 bits tag the kind of feature:
+# 0: the identity of the state (see `encodeIdentityFeature()`), 1: (street, my_id, hand, number of actions on the
+# street), 2: (street, hand, last action), 3: (street, hand, pot).
+# The coarser features let the agent generalize over action histories it has not seen yet. The street is in the high
+# bits, so the pre-flop features are the same as in the pre-flop only game.
+def stateFeatureExtractor(state: State) -> List[Tuple[int, float]]:
+    my_id = state.exclusive.my_id
+    card_1, card_2 = state.exclusive.my_hand
+    public = state.public
+    street = public.street
+    history = public.streetActions()[street]
+    hand = card_1 << 6 | card_2
+    return [((((publicCode(public) << 4 | my_id) << 12 | hand) << 2), 1),
+            (((((street << 16 | len(history)) << 4 | my_id) << 12 | hand) << 2) | 1, 1),
+            ((((street << 6 | history.code & 0x3F) << 12 | hand) << 2) | 2, 1),
+            ((((street << 48 | int(public.pot)) << 12 | hand) << 2) | 3, 1)]
 
 
 def main():
@@ -197,21 +487,22 @@ def main():
     learning_agent = QLearningAgent(getActions, 1.0, identityFeatureExtractor, weights_file='')
     learning_agent_2 = QLearningAgent(getActions, 1.0, identityFeatureExtractor, weights_file='')
 
-    simulator = TexasHoldemSimulator([learning_agent, AKQAgent()], verbose=0)
-    simulator.run(100000)
+    simulator = TexasHoldemSimulator([learning_agent, AKQAgent()], verbose=0, profiler=Profiler(sample_every=100))
+    simulator.run(100000, checkpoint_every=10000, plot_file='cumulative_reward.png')
+    print(simulator.profiler.report())
     
     # Print the learned Q value regarding to state-action.
     if True:
         for feature, value in learning_agent.weights.items():
+            feature = decodeIdentityFeature(feature)
             print(f'{feature} {value}')
             # if feature[1][0] != 2 and value > 0:
             #     input("This might be a bluff!")
     print(f'Number of features: {len(learning_agent.weights)}')
 
     # Save the learning progress.
-    json_name = input('Type the file name to store the weights: ')
-    with open(f'{json_name}.pkl', 'wb') as file:
-        pickle.dump([learning_agent.weights, learning_agent.numIters], file)
+    file_name = input('Type the file name to store the weights: ')
+    learning_agent.saveWeights(f'{file_name}.ckpt')
 
 
 if __name__ == "__main__":
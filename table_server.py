@@ -0,0 +1,337 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import sys
+
+from learning_agent import LearningAgent, AKQAgent
+from game_state import State, Action
+from instrumentation import SimulatorHooks
+from simulator import TexasHoldemSimulator
+
+
+# asyncio table server: one process hosts many `TexasHoldemSimulator` tables, each table plays its hands as a task
+# driving `TexasHoldemSimulator.handSteps()`.
+#
+# Seats:
+# - A plain `LearningAgent` is called inline, it should be cheap (e.g. `AKQAgent`, `FrozenPolicyAgent`).
+# - An `ExecutorAgent` runs a CPU heavy agent in a thread or process pool, so the other tables keep playing.
+# - A `RemoteAgent` is played by a client over TCP or a Unix socket, with a per-seat action timeout.
+#
+# Protocol: one JSON object per line.
+#   client -> server: {"join": table, "seat": seat}
+#                     {"table": table, "seat": seat, "action": "FOLD" | "CALL" | "RAISE"}
+#   server -> client: {"event": "joined", "table", "seat"}
+#                     {"event": "act", "table", "seat", "hand", "board", "actions" (one list per street), "pot", "call_cost",
+#                      "raise_cost", "chips"}
+#                     {"event": "timeout", "table", "seat", "action"}
+#                     {"event": "hand_end", "table", "seat", "payoffs"}
+#                     {"event": "error", "message"}
+
+
+# An agent whose decisions are awaited. It can only sit at a `Table`.
+class AsyncAgent(LearningAgent):
+    async def getActionAsync(self, state: State) -> Action: raise NotImplementedError("Override me")
+
+    def getAction(self, state: State) -> Action:
+        raise TypeError(f'{type(self).__name__} can only play at a table_server table')
+
+    # The hand is over, `payoffs` is the chip change of each player.
+    def onHandEnd(self, payoffs: List[float]) -> None: pass
+
+
+
+# Agents installed in a worker process of `TableServer`, by index. Only the states and actions cross the process
+# boundary for each decision.
+_worker_agents: List[LearningAgent] = []
+
+
+def _installWorkerAgents(agents: List[LearningAgent]) -> None:
+    _worker_agents[:] = agents
+
+
+def _workerAction(index: int, state: State) -> Action:
+    return _worker_agents[index].getAction(state)
+
+
+
+# Run `agent.getAction()` in `executor`, a thread pool or the process pool of `TableServer`. In a process pool the
+# agent is the copy installed once in each worker (`worker_index`), so it can't learn: use a read-only agent (e.g. a
+# `QLearningAgent` with `read_only`, or a `FrozenPolicyAgent`), see `TableServer.workerBot()`.
+class ExecutorAgent(AsyncAgent):
+    def __init__(self, agent: LearningAgent, executor: Optional[Executor] = None, worker_index: Optional[int] = None):
+        self.agent = agent
+        self.executor = executor
+        self.worker_index = worker_index
+
+    async def getActionAsync(self, state: State) -> Action:
+        if self.worker_index is not None:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, _workerAction, self.worker_index, state)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.agent.getAction, state)
+
+    def incorporateFeedback(self, state: State, action: Action, reward: float, newState: Optional[State]) -> None:
+        self.agent.incorporateFeedback(state, action, reward, newState)
+
+
+
+# A seat played by a client connection, see `TableServer`.
+class RemoteAgent(AsyncAgent):
+    def __init__(self, table_id: int, seat: int):
+        self.table_id = table_id
+        self.seat = seat
+        self.connection: Optional['Connection'] = None
+        self.joined = asyncio.Event()
+        self.actions: asyncio.Queue = asyncio.Queue()
+
+
+    async def getActionAsync(self, state: State) -> Action:
+        while not self.actions.empty():
+            self.actions.get_nowait()  # Late answers of a timed out decision.
+        self.send({'event': 'act', 'hand': list(state.exclusive.my_hand), 'board': list(state.public.cards),
+                   'actions': [[[player, action.name] for player, action in history] for history in state.public.streetActions()],
+                   'pot': state.public.pot, 'call_cost': state.getCallCost(), 'raise_cost': state.getRaiseCost(), 'chips': state.exclusive.chips})
+        return await self.actions.get()
+
+
+    def onHandEnd(self, payoffs: List[float]) -> None:
+        self.send({'event': 'hand_end', 'payoffs': payoffs})
+
+
+    def send(self, message: dict) -> None:
+        if self.connection is not None:
+            self.connection.send({**message, 'table': self.table_id, 'seat': self.seat})
+
+
+
+# Forward the end of each hand to the async seats of a table.
+class _TableHooks(SimulatorHooks):
+    def __init__(self, seats: List[AsyncAgent]):
+        self.seats = seats
+
+    def onHandEnd(self, simulator, payoffs):
+        for seat in self.seats:
+            seat.onHandEnd(payoffs)
+
+
+
+class Table:
+    # `streets` and `stack` are passed to the simulator, see `TexasHoldemSimulator`.
+    def __init__(self, table_id: int, agents: List[LearningAgent], seat_timeout=30.0, deck_variant='akq', streets=1, stack=0):
+        self.table_id = table_id
+        self.seat_timeout = seat_timeout
+        self.async_seats = [agent for agent in agents if isinstance(agent, AsyncAgent)]
+        self.simulator = TexasHoldemSimulator(agents, verbose=0, hooks=[_TableHooks(self.async_seats)],
+                                              deck_variant=deck_variant, streets=streets, stack=stack)
+        self.hands = 0
+        self.timeouts = 0
+
+
+    # On timeout a seat checks if it can, otherwise folds.
+    async def decide(self, id: int, state: State) -> Action:
+        agent = self.simulator.agents[id]
+        if not isinstance(agent, AsyncAgent):
+            return agent.getAction(state)
+        try:
+            return await asyncio.wait_for(agent.getActionAsync(state), self.seat_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            action = Action.CALL if state.getCallCost() == 0 else Action.FOLD
+            if isinstance(agent, RemoteAgent):
+                agent.send({'event': 'timeout', 'action': action.name})
+            return action
+
+
+    async def playHand(self) -> List[float]:
+        steps = self.simulator.handSteps()
+        try:
+            id, state = next(steps)
+        except StopIteration as stop:
+            self.hands += 1
+            return stop.value
+        while True:
+            action = await self.decide(id, state)  # NOTE: Outside of the try, a StopIteration of an agent must propagate.
+            try:
+                id, state = steps.send(action)
+            except StopIteration as stop:
+                self.hands += 1
+                return stop.value
+
+
+    # Wait for the remote seats, then play `hands` hands. Other tables run between hands.
+    async def play(self, hands: int) -> None:
+        for seat in self.async_seats:
+            if isinstance(seat, RemoteAgent):
+                await seat.joined.wait()
+        for _ in range(hands):
+            await self.playHand()
+            await asyncio.sleep(0)
+
+
+
+# A client connection, it can sit at any number of seats.
+class Connection:
+    def __init__(self, server: 'TableServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.seats: Dict[Tuple[int, int], RemoteAgent] = {}
+
+
+    def send(self, message: dict) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+
+    async def serve(self) -> None:
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    self.handle(json.loads(line))
+                except (ValueError, KeyError, TypeError) as error:
+                    self.send({'event': 'error', 'message': str(error)})
+                await self.writer.drain()
+        finally:
+            for seat in self.seats.values():
+                seat.connection = None  # The seat times out from now on.
+            self.writer.close()
+
+
+    def handle(self, message: dict) -> None:
+        if 'join' in message:
+            seat = self.server.remoteSeat(int(message['join']), int(message['seat']))
+            if seat.connection is not None and seat.connection is not self:
+                raise ValueError(f"Seat {message['seat']} of table {message['join']} is taken")
+            seat.connection = self
+            self.seats[(seat.table_id, seat.seat)] = seat
+            seat.send({'event': 'joined'})
+            seat.joined.set()
+        else:
+            seat = self.seats[(int(message['table']), int(message['seat']))]
+            seat.actions.put_nowait(Action[message['action']])
+
+
+
+# `worker_agents` are installed once in each of `workers` processes, for the CPU heavy bots of `self.workerBot()`.
+# The other bots run in `executor`, a thread pool by default.
+class TableServer:
+    def __init__(self, executor: Optional[Executor] = None, worker_agents: Optional[List[LearningAgent]] = None, workers: Optional[int] = None):
+        self.executor = executor or ThreadPoolExecutor()
+        self.worker_agents = list(worker_agents or [])
+        self.process_pool = None
+        if self.worker_agents:
+            self.process_pool = ProcessPoolExecutor(workers, initializer=_installWorkerAgents, initargs=(self.worker_agents,))
+        self.tables: List[Table] = []
+        self.tasks: List[asyncio.Task] = []
+        self.servers: List[asyncio.AbstractServer] = []
+
+
+    # `agents` can contain None for the seats played by clients. CPU heavy agents should be wrapped in
+    # `ExecutorAgent`, see `self.bot()` and `self.workerBot()`.
+    def addTable(self, agents: List[Optional[LearningAgent]], hands: int, seat_timeout=30.0, deck_variant='akq', streets=1, stack=0) -> Table:
+        table_id = len(self.tables)
+        seats = [agent if agent is not None else RemoteAgent(table_id, seat) for seat, agent in enumerate(agents)]
+        table = Table(table_id, seats, seat_timeout, deck_variant, streets, stack)
+        self.tables.append(table)
+        self.tasks.append(asyncio.get_running_loop().create_task(table.play(hands)))
+        return table
+
+
+    def bot(self, agent: LearningAgent) -> ExecutorAgent:
+        return ExecutorAgent(agent, self.executor)
+
+
+    # A seat played by `worker_agents[index]` in the process pool.
+    def workerBot(self, index: int) -> ExecutorAgent:
+        if self.process_pool is None or not 0 <= index < len(self.worker_agents):
+            raise ValueError(f'No worker agent {index}')
+        return ExecutorAgent(self.worker_agents[index], self.process_pool, index)
+
+
+    def remoteSeat(self, table_id: int, seat: int) -> RemoteAgent:
+        if not 0 <= table_id < len(self.tables):
+            raise ValueError(f'No table {table_id}')
+        if not 0 <= seat < len(self.tables[table_id].simulator.agents):
+            raise ValueError(f'No seat {seat} at table {table_id}')
+        agent = self.tables[table_id].simulator.agents[seat]
+        if not isinstance(agent, RemoteAgent):
+            raise ValueError(f'Seat {seat} of table {table_id} is not a remote seat')
+        return agent
+
+
+    async def onConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await Connection(self, reader, writer).serve()
+
+
+    async def listenTcp(self, host='127.0.0.1', port=8765) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.onConnection, host, port)
+        self.servers.append(server)
+        return server
+
+
+    async def listenUnix(self, path: str) -> asyncio.AbstractServer:
+        server = await asyncio.start_unix_server(self.onConnection, path)
+        self.servers.append(server)
+        return server
+
+
+    # Wait until every table played all its hands.
+    async def wait(self) -> None:
+        await asyncio.gather(*self.tasks)
+
+
+    def close(self) -> None:
+        for server in self.servers:
+            server.close()
+        self.executor.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+
+
+
+# Play seats of a server from the console, the non-blocking replacement of `HumanAgent`.
+async def consoleClient(host: str, port: int, seats: List[Tuple[int, int]]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    for table_id, seat in seats:
+        writer.write(json.dumps({'join': table_id, 'seat': seat}).encode() + b'\n')
+    loop = asyncio.get_running_loop()
+    while line := await reader.readline():
+        message = json.loads(line)
+        print(message)
+        if message['event'] == 'act':
+            answer = await loop.run_in_executor(None, input, '1:FOLD 2:CALL/CHECK 3:RAISE? ')
+            action = {'1': 'FOLD', '2': 'CALL', '3': 'RAISE'}.get(answer.strip(), 'CALL')
+            writer.write(json.dumps({'table': message['table'], 'seat': message['seat'], 'action': action}).encode() + b'\n')
+            await writer.drain()
+
+
+async def serve(tables: int, hands: int, host: str, port: int) -> None:
+    server = TableServer()
+    for _ in range(tables):
+        server.addTable([None, AKQAgent()], hands)
+    await server.listenTcp(host, port)
+    print(f'Serving {tables} tables on {host}:{port}, join seat 0 of any table.')
+    await server.wait()
+    server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Host human vs. bot tables, or play at one.')
+    parser.add_argument('--client', action='store_true', help='Play seat 0 of --table from the console.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tables', type=int, default=100)
+    parser.add_argument('--table', type=int, default=0)
+    parser.add_argument('--hands', type=int, default=100)
+    args = parser.parse_args(argv)
+    if args.client:
+        asyncio.run(consoleClient(args.host, args.port, [(args.table, 0)]))
+    else:
+        asyncio.run(serve(args.tables, args.hands, args.host, args.port))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,47 @@
+import numpy as np
+
+from learning_agent import LearningAgent, SingleActionAgent
+from game_state import Action, State, BatchState
+from batch_simulator import BatchTexasHoldemSimulator
+from simulator import TexasHoldemSimulator
+
+
+# Deterministic agent acting on its card and the history: raise the top rank while the history is short, fold the
+# bottom rank facing a bet, otherwise call. Both the scalar and the batched policy.
+class RankAgent(LearningAgent):
+    def __init__(self, ranks: int):
+        self.ranks = ranks
+
+    def getAction(self, state: State) -> Action:
+        rank = state.exclusive.my_hand[0] % self.ranks
+        if rank == self.ranks - 1 and len(state.public.preflop_actions) < 6:
+            return Action.RAISE
+        if rank == 0 and state.getCallCost() > 0:
+            return Action.FOLD
+        return Action.CALL
+
+    def getActions(self, states: BatchState) -> np.ndarray:
+        rank = states.my_hand[:, 0] % self.ranks
+        return np.where((rank == self.ranks - 1) & (states.num_actions < 6), Action.RAISE.value,
+                        np.where((rank == 0) & (states.getCallCost() > 0), Action.FOLD.value, Action.CALL.value))
+
+
+# Play the decks of one batch with the scalar simulator, one stacked deck per hand.
+def scalarResults(agents, variant: str, decks: np.ndarray) -> np.ndarray:
+    simulator = TexasHoldemSimulator(agents, verbose=0, deck_variant=variant)
+    results = []
+    for deck in decks:
+        simulator.deck.stack(deck[:len(agents)].tolist())
+        results.append(simulator.playOneHand(simulator.deck))
+    return np.array(results)
+
+
+def testBatchMatchesScalar():
+    for variant, players in (('akq', 2), ('akq', 3), ('leduc', 2), ('leduc', 4)):
+        ranks = 3 if variant == 'akq' else 5
+        make_agents = lambda: [RankAgent(ranks) if id % 2 == 0 else SingleActionAgent(Action.CALL) for id in range(players)]
+        simulator = BatchTexasHoldemSimulator(make_agents(), seed=players, deck_variant=variant)
+        decks = simulator.dealDecks(500)
+        results = simulator.playHands(decks)
+        np.testing.assert_allclose(results, scalarResults(make_agents(), variant, decks))
+        np.testing.assert_allclose(simulator.chips, results.sum(axis=0))
\ No newline at end of file
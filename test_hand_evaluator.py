@@ -0,0 +1,73 @@
+from itertools import combinations
+from typing import Sequence, Tuple
+import random
+
+import numpy as np
+
+import hand_evaluator
+
+
+# Naive ranking of exactly 5 cards: (category, tie breaking ranks), compared as tuples. Independent of the tables.
+def naiveKey(cards: Sequence[int]) -> Tuple[int, ...]:
+    ranks = [card % hand_evaluator.kNumRanks for card in cards]
+    groups = sorted(((ranks.count(rank), rank) for rank in set(ranks)), reverse=True)
+    counts = [count for count, _ in groups]
+    order = [rank for _, rank in groups]
+    flush = len({card // hand_evaluator.kNumRanks for card in cards}) == 1
+    straight = len(order) == 5 and (order[0] - order[4] == 4 or order == [12, 3, 2, 1, 0])
+    high = 3 if order == [12, 3, 2, 1, 0] else order[0]
+    if straight and flush:
+        return (hand_evaluator.STRAIGHT_FLUSH, high)
+    if counts[0] == 4:
+        return (hand_evaluator.FOUR_OF_A_KIND, *order)
+    if counts == [3, 2]:
+        return (hand_evaluator.FULL_HOUSE, *order)
+    if flush:
+        return (hand_evaluator.FLUSH, *order)
+    if straight:
+        return (hand_evaluator.STRAIGHT, high)
+    if counts[0] == 3:
+        return (hand_evaluator.THREE_OF_A_KIND, *order)
+    if counts[:2] == [2, 2]:
+        return (hand_evaluator.TWO_PAIR, *order)
+    if counts[0] == 2:
+        return (hand_evaluator.ONE_PAIR, *order)
+    return (hand_evaluator.HIGH_CARD, *order)
+
+
+# Best 5 card key of 5~7 cards, by trying every subset.
+def bruteForceKey(cards: Sequence[int]) -> Tuple[int, ...]:
+    return max(naiveKey(subset) for subset in combinations(cards, 5))
+
+
+def randomHands(count: int, num_cards: int, seed=0):
+    rng = random.Random(seed)
+    return [rng.sample(range(hand_evaluator.kNumRanks * hand_evaluator.kNumSuits), num_cards) for _ in range(count)]
+
+
+# Some hands of each category, so the rare ones are compared too.
+def categoryHands():
+    return [[8, 9, 10, 11, 12, 0, 13], [12, 0, 1, 2, 3, 30, 45], [5, 18, 31, 44, 0, 1, 2], [5, 18, 31, 6, 19, 0, 1],
+            [5, 18, 31, 6, 19, 32, 0], [0, 2, 4, 6, 8, 10, 13], [0, 1, 2, 3, 4, 5, 17], [0, 14, 28, 42, 4, 20, 35],
+            [5, 18, 31, 0, 14, 27, 40], [5, 18, 6, 19, 7, 20, 0], [5, 18, 6, 19, 0, 14, 28], [5, 18, 0, 14, 29, 43, 10],
+            [0, 14, 28, 42, 4, 19, 36], [12, 25, 38, 51, 0, 1, 2]]
+
+
+def testMatchesBruteForce():
+    for num_cards in (5, 6, 7):
+        hands = randomHands(150, num_cards, seed=num_cards) + [hand[:num_cards] for hand in categoryHands()]
+        values = [hand_evaluator.evaluate(hand) for hand in hands]
+        keys = [bruteForceKey(hand) for hand in hands]
+        for value, key in zip(values, keys):
+            assert value >> 20 == key[0]
+        for i in range(len(hands)):
+            for j in range(len(hands)):
+                assert (values[i] < values[j]) == (keys[i] < keys[j]), (hands[i], hands[j])
+
+
+def testScalarMaskAndBatchAgree():
+    for num_cards in (5, 6, 7):
+        hands = randomHands(2000, num_cards, seed=10 + num_cards) + [hand[:num_cards] for hand in categoryHands()]
+        values = [hand_evaluator.evaluate(hand) for hand in hands]
+        assert [hand_evaluator.evaluateMask(sum(1 << card for card in hand)) for hand in hands] == values
+        assert hand_evaluator.evaluateBatch(np.array(hands)).tolist() == values
\ No newline at end of file
@@ -0,0 +1,54 @@
+from game_state import State, PublicState, ExclusiveState, Action, kEmptyHistory, kPreFlop, kFlop, kTurn, publicCode, decodePublicCode
+from simulator import identityFeatureExtractor, stateFeatureExtractor, decodeIdentityFeature
+from policy_table import encodeInfoset, publicFromCode
+
+
+# Heads-up public state after the blinds and a call, on `street` with the first `len(cards)` board cards.
+def makePublic(street: int, cards=()) -> PublicState:
+    public = PublicState(2)
+    public.preflop_actions = kEmptyHistory.append(0, Action.RAISE).append(1, Action.RAISE).append(0, Action.CALL)
+    public.street = street
+    public.cards = tuple(cards)
+    return public
+
+
+def testPreFlopCodeIsTheHistory():
+    public = makePublic(kPreFlop)
+    assert publicCode(public) == public.preflop_actions.code
+
+
+def testStreetsGetDifferentKeys():
+    hand = (12, 25)
+    preflop = State(ExclusiveState(1, hand), makePublic(kPreFlop))
+    flop = State(ExclusiveState(1, hand), makePublic(kFlop, (0, 1, 2)))
+    other_flop = State(ExclusiveState(1, hand), makePublic(kFlop, (0, 1, 3)))
+    turn = State(ExclusiveState(1, hand), makePublic(kTurn, (0, 1, 2, 3)))
+    states = [preflop, flop, other_flop, turn]
+
+    identity_keys = {identityFeatureExtractor(state, Action.CALL)[0][0] for state in states}
+    state_keys = {stateFeatureExtractor(state)[0][0] for state in states}
+    infosets = {encodeInfoset(1, hand, publicCode(state.public)) for state in states}
+    assert len(identity_keys) == len(state_keys) == len(infosets) == len(states)
+
+
+def testStreetActionsGetDifferentKeys():
+    checked = makePublic(kFlop, (0, 1, 2))
+    checked.flop_actions = kEmptyHistory.append(1, Action.CALL)
+    bet = makePublic(kFlop, (0, 1, 2))
+    bet.flop_actions = kEmptyHistory.append(1, Action.RAISE)
+    assert publicCode(checked) != publicCode(bet)
+
+
+def testPublicCodeRoundTrip():
+    public = makePublic(kTurn, (0, 51, 7, 13))
+    public.flop_actions = kEmptyHistory.append(1, Action.CALL).append(0, Action.RAISE).append(1, Action.CALL)
+    public.turn_actions = kEmptyHistory.append(1, Action.RAISE)
+    street, histories, cards = decodePublicCode(publicCode(public))
+    assert street == kTurn
+    assert cards == public.cards
+    assert histories[:street + 1] == public.streetActions()
+
+    my_id, my_hand, code, action = decodeIdentityFeature(identityFeatureExtractor(State(ExclusiveState(1, (3, 4)), public), Action.FOLD)[0][0])
+    assert (my_id, my_hand, code, action) == (1, (3, 4), publicCode(public), Action.FOLD)
+    replayed = publicFromCode(code, 2)
+    assert (replayed.street, replayed.cards, replayed.pot) == (kTurn, public.cards, 12)
\ No newline at end of file
@@ -0,0 +1,173 @@
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+import hashlib
+
+import numpy as np
+
+
+# Map each feature key to a dense int index, in the order they are first seen.
+# The dict keeps its insertion order, so iterating `index` gives the keys in index order.
+class FeatureInterner:
+    def __init__(self):
+        self.index: Dict[Any, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+    # Return the index of the key, or -1 if the key has never been interned.
+    def lookup(self, key: Any) -> int:
+        return self.index.get(key, -1)
+
+
+    def intern(self, key: Any) -> int:
+        idx = self.index.get(key)
+        if idx is None:
+            idx = self.index[key] = len(self.index)
+        return idx
+
+
+
+# Linear weights stored in a growable `array('d')`, indexed through a `FeatureInterner`.
+# The learners work on index lists: `lookup()` or `intern()` the features once, then `dot()` and `update()`.
+# It also behaves like the former `defaultdict(float)` weights: `weights[key]`, `items()` and `len()`.
+class WeightStore:
+    def __init__(self):
+        self.interner = FeatureInterner()
+        self.values = array('d')
+
+
+    @staticmethod
+    def fromItems(items: Iterable[Tuple[Any, float]]) -> 'WeightStore':
+        weights = WeightStore()
+        for key, value in items:
+            weights[key] = value
+        return weights
+
+
+    # Unknown features get index -1, which has weight 0 and is skipped by `update()`.
+    def lookup(self, features: List[Tuple[Any, float]]) -> Tuple[List[int], List[float]]:
+        index = self.interner.index
+        return [index.get(key, -1) for key, _ in features], [value for _, value in features]
+
+
+    # Same as `lookup()`, but unknown features are added with weight 0.
+    def intern(self, features: List[Tuple[Any, float]]) -> Tuple[List[int], List[float]]:
+        indices = []
+        for key, _ in features:
+            idx = self.interner.intern(key)
+            if idx == len(self.values):
+                self.values.append(0.0)
+            indices.append(idx)
+        return indices, [value for _, value in features]
+
+
+    def dot(self, indices: List[int], values: List[float]) -> float:
+        weights = self.values
+        score = 0.0
+        for idx, value in zip(indices, values):
+            if idx >= 0:
+                score += weights[idx] * value
+        return score
+
+
+    # weights -= coefficient * values
+    def update(self, indices: List[int], values: List[float], coefficient: float) -> None:
+        weights = self.values
+        for idx, value in zip(indices, values):
+            if idx >= 0:
+                weights[idx] -= coefficient * value
+
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.interner.index
+
+
+    def __getitem__(self, key: Any) -> float:
+        idx = self.interner.lookup(key)
+        return self.values[idx] if idx >= 0 else 0.0
+
+
+    def __setitem__(self, key: Any, value: float) -> None:
+        idx = self.interner.intern(key)
+        if idx == len(self.values):
+            self.values.append(value)
+        else:
+            self.values[idx] = value
+
+
+    def keys(self) -> Iterator[Any]:
+        return iter(self.interner.index)
+
+
+    def items(self) -> Iterator[Tuple[Any, float]]:
+        return zip(self.interner.index, self.values)
+
+
+
+kHashMultiplier = np.uint64(0x9E3779B97F4A7C15)
+
+
+# Deterministic 64-bit hash of a feature key. Unlike `hash()`, it is the same in every process, so hashed weights
+# can be saved and shared with workers.
+def hashKey(key: Any) -> int:
+    if type(key) is int:
+        data = key.to_bytes(key.bit_length() // 8 + 1, 'little', signed=True)
+    else:
+        data = repr(key).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+
+# Fixed-size weights for feature hashing. Each (feature, salt) pair goes to one of 2^bits buckets, so the memory is
+# 8 * 2^bits bytes whatever the number of features. Colliding features share a weight.
+# The features are hashed once (`hashFeatures()`), then `buckets()` salts them for any number of actions at once:
+#   bucket = ((feature_hash ^ salt) * kHashMultiplier mod 2^64) >> (64 - bits)
+class HashedWeights:
+    def __init__(self, bits=18):
+        self.bits = bits
+        self.shift = np.uint64(64 - bits)
+        self.values = np.zeros(1 << bits)
+
+
+    @staticmethod
+    def hashFeatures(features: List[Tuple[Any, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        return np.array([hashKey(key) for key, _ in features], dtype=np.uint64), np.array([value for _, value in features], dtype=np.float64)
+
+
+    # Bucket of each feature for each salt, with shape (salts, features).
+    def buckets(self, hashes: np.ndarray, salts: np.ndarray) -> np.ndarray:
+        return (((hashes[None, :] ^ salts[:, None]) * kHashMultiplier) >> self.shift).astype(np.intp)
+
+
+    # One score per row of `buckets`.
+    def dot(self, buckets: np.ndarray, values: np.ndarray) -> np.ndarray:
+        return self.values[buckets] @ values
+
+
+    # weights -= coefficient * values, colliding buckets are all updated.
+    def update(self, buckets: np.ndarray, values: np.ndarray, coefficient: float) -> None:
+        np.subtract.at(self.values, buckets, coefficient * values)
+
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+    def save(self, path: str, num_iters: int) -> None:
+        with open(path, 'wb') as file:
+            np.savez(file, values=self.values, num_iters=num_iters)
+
+
+    @staticmethod
+    def load(path: str) -> Tuple['HashedWeights', int]:
+        with np.load(path) as data:
+            values = data['values']
+            weights = HashedWeights(int(values.size).bit_length() - 1)
+            weights.values = values.copy()
+            return weights, int(data['num_iters'])
\ No newline at end of file